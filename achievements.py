@@ -0,0 +1,63 @@
+"""Event-driven achievement unlocking.
+
+Every rule in game_mechanics.ACHIEVEMENT_RULES names the game state fields
+it depends on. An action tells the engine which fields it changed, and
+only the rules that depend on them and are still locked are checked; a
+move changes none of them and costs nothing.
+
+An unlock is recorded in game_state["achievements"] under its key, and
+its points are added to the score in the same step, so an achievement is
+never awarded (or paid) twice.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from game_mechanics import ACHIEVEMENT_RULES, ACHIEVEMENTS, Achievement, AchievementRule
+from metrics import ACHIEVEMENTS_UNLOCKED
+
+
+class AchievementEngine:
+    def __init__(self, rules: Iterable[AchievementRule], achievements: Dict[str, Achievement]):
+        self.achievements = achievements
+        by_field = defaultdict(list)
+        for rule in rules:
+            if rule.key not in achievements:
+                raise ValueError(f"Rule for unknown achievement {rule.key!r}")
+            for field in rule.depends_on:
+                by_field[field].append(rule)
+        self.rules_by_field = {field: tuple(rules) for field, rules in by_field.items()}
+
+    def update(self, game_state, changed: Iterable[str]) -> List[str]:
+        """Check the rules depending on the changed fields; return the keys unlocked"""
+        unlocked = []
+        checked = set()
+        for field in changed:
+            for rule in self.rules_by_field.get(field, ()):
+                if rule.key in checked or rule.key in game_state["achievements"]:
+                    continue
+                checked.add(rule.key)
+                if rule.condition(game_state) and self.unlock(game_state, rule.key):
+                    unlocked.append(rule.key)
+        return unlocked
+
+    def unlock(self, game_state, key: str) -> bool:
+        """Record an achievement and add its points, unless it was already unlocked"""
+        if key in game_state["achievements"]:
+            return False
+        points = self.achievements[key].points
+        game_state["achievements"][key] = {"achieved": True, "points": points,
+                                           "moves": game_state["moves"]}
+        score = game_state["score"]
+        score["achievements"] = score.get("achievements", 0) + points
+        score["total"] += points
+        ACHIEVEMENTS_UNLOCKED.inc(key)
+        return True
+
+    def describe(self, keys: Iterable[str]) -> List[Dict]:
+        """Unlocked achievements as the client shows them"""
+        return [{"key": key, "name": self.achievements[key].name,
+                 "icon": self.achievements[key].icon, "points": self.achievements[key].points}
+                for key in keys]
+
+
+ENGINE = AchievementEngine(ACHIEVEMENT_RULES, ACHIEVEMENTS)
@@ -0,0 +1,239 @@
+"""ASGI entry point: the game's JSON routes on an event loop, everything else through Flask.
+
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+The JSON routes read and write the same server-side session store as the
+WSGI app and run the shared rules in game_actions on a small thread pool,
+so a slow client only costs an idle connection instead of a whole worker.
+Pages, static files and everything else are handed to the Flask app
+unchanged. With SESSION_BACKEND=cookie every route goes through Flask.
+"""
+import asyncio
+import io
+import logging
+import os
+import sys
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import CookieError, SimpleCookie
+from urllib.parse import parse_qsl
+
+from flask import json
+
+import game_actions
+from content_pack import CONTENT
+from metrics import request_finished, request_started
+from app import GAME_ACTIONS, JOURNAL, PROFILER, LEADERBOARD, app as flask_app
+from session_store import ServerSideSession, ServerSideSessionInterface
+
+logger = logging.getLogger(__name__)
+
+# Game actions run on this many threads per process; connections are not limited by it
+THREADS = int(os.environ.get("ASGI_THREADS", 32))
+
+MAX_BODY_SIZE = 1024 * 1024
+
+# path -> (method, action) for the routes served without going through Flask
+ROUTES = {
+    "/move": ("POST", GAME_ACTIONS["move"]),
+    "/solve_riddle": ("POST", GAME_ACTIONS["solve_riddle"]),
+    "/handle_event": ("POST", GAME_ACTIONS["handle_event"]),
+    "/check_location": ("GET", GAME_ACTIONS["check_location"]),
+    "/complete_game": ("POST", GAME_ACTIONS["complete_game"]),
+    "/state": ("GET", game_actions.state),
+}
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def read_body(receive, limit=MAX_BODY_SIZE):
+    body = bytearray()
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body.extend(message.get("body", b""))
+        if len(body) > limit:
+            raise BodyTooLarge()
+        more_body = message.get("more_body", False)
+    return bytes(body)
+
+
+def wsgi_environ(scope, body):
+    """Build the WSGI environ for an ASGI HTTP request"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        # The body has already been read in full (possibly from a chunked upload)
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope["headers"]:
+        name, value = raw_name.decode("latin-1").lower(), raw_value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name != "content-length":
+            key = "HTTP_" + name.upper().replace("-", "_")
+            separator = "; " if name == "cookie" else ","
+            environ[key] = environ[key] + separator + value if key in environ else value
+    return environ
+
+
+class GameApp:
+    """ASGI application serving the JSON game routes natively and the rest via Flask"""
+
+    def __init__(self, app, threads=THREADS):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+        self.native = isinstance(app.session_interface, ServerSideSessionInterface)
+        if not self.native:
+            logger.warning("Cookie sessions can't be shared with the ASGI routes; "
+                           "serving everything through Flask")
+        self.sessions = app.session_interface
+        self.lifetime = app.permanent_session_lifetime.total_seconds()
+        # One lock per session so a player's actions are applied in order
+        self.locks = weakref.WeakValueDictionary()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            route = ROUTES.get(scope["path"]) if self.native else None
+            try:
+                if route is not None and route[0] == scope["method"]:
+                    await self.game_route(scope, receive, send, route[1])
+                else:
+                    await self.wsgi(scope, receive, send)
+            except BodyTooLarge:
+                await self.send_json(send, 413, {"error": "Request body too large"})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self.executor, LEADERBOARD.flush)
+                await loop.run_in_executor(self.executor, JOURNAL.flush)
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _session_id(self, scope):
+        cookies = "; ".join(value.decode("latin-1") for name, value in scope["headers"]
+                            if name.lower() == b"cookie")
+        try:
+            morsel = SimpleCookie(cookies).get(self.app.session_cookie_name)
+        except CookieError:
+            return None
+        return self.sessions.session_id(self.app, morsel.value) if morsel else None
+
+    async def game_route(self, scope, receive, send, action):
+        if scope["method"] == "GET":
+            payload = dict(parse_qsl(scope["query_string"].decode("latin-1")))
+        else:
+            body = await read_body(receive)
+            try:
+                payload = json.loads(body) if body else None
+            except ValueError:
+                payload = None
+
+        sid = self._session_id(scope)
+        loop = asyncio.get_running_loop()
+        if sid is None:
+            response, status = await loop.run_in_executor(
+                self.executor, self.run_action, None, action, payload, scope)
+        else:
+            lock = self.locks.get(sid)
+            if lock is None:
+                lock = self.locks[sid] = asyncio.Lock()
+            async with lock:
+                response, status = await loop.run_in_executor(
+                    self.executor, self.run_action, sid, action, payload, scope)
+        await self.send_json(send, status, response)
+
+    def run_action(self, sid, action, payload, scope):
+        """Load the player's session, apply an action and store the changes (runs in a thread)"""
+        CONTENT.refresh()
+        started = request_started()
+        with PROFILER.request(f"{scope['method']} {scope['path']}", sid):
+            response, status = self._run_action(sid, action, payload)
+        request_finished(started, scope["method"], scope["path"], status)
+        return response, status
+
+    def _run_action(self, sid, action, payload):
+        session = self.sessions.load(sid) if sid else None
+        try:
+            if session is None:
+                # Without a stored game there is nothing to save; the action reports it
+                return action(ServerSideSession(new=True), payload)
+            response, status = action(session, payload)
+        except Exception:
+            logger.exception("Error handling %s", getattr(action, "__name__", action))
+            return {"error": "Internal error"}, 500
+        self.sessions.persist(session, self.lifetime)
+        return response, status
+
+    async def send_json(self, send, status, payload):
+        body = json.dumps(payload, app=self.app).encode("utf-8")
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def wsgi(self, scope, receive, send):
+        """Run the Flask app in the thread pool, streaming its response back"""
+        environ = wsgi_environ(scope, await read_body(receive))
+        loop = asyncio.get_running_loop()
+        started = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                  for name, value in headers]
+            return written.append
+
+        def begin():
+            result = self.app(environ, start_response)
+            iterator = iter(result)
+            # Responses may only call start_response once iteration starts
+            return result, iterator, next(iterator, None)
+
+        result, iterator, chunk = await loop.run_in_executor(self.executor, begin)
+        try:
+            await send({"type": "http.response.start", "status": started["status"],
+                        "headers": started["headers"]})
+            for data in written:
+                await send({"type": "http.response.body", "body": data, "more_body": True})
+            while chunk is not None:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(self.executor, result.close)
+
+
+app = GameApp(flask_app)
@@ -0,0 +1,160 @@
+"""Fingerprinted, long-cached delivery of the files under static/.
+
+Every file is hashed once at startup and served from
+/assets/<name>.<hash>.<ext>. A new version of a file gets a new URL, so
+responses can be cached by browsers and proxies forever. Audio supports
+Range requests for seeking, file bodies are handed to the WSGI server's
+file_wrapper (gunicorn turns that into sendfile) and CSS/JS are kept
+gzipped in memory for clients that accept it.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from flask import Blueprint, abort, current_app, request, url_for
+
+# Fingerprinted URLs never change content, so let everything cache them for a year
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Extensions served gzipped to clients that accept it
+COMPRESSIBLE = {".css", ".js"}
+
+CHUNK_SIZE = 64 * 1024
+
+assets = Blueprint("assets", __name__)
+
+
+@dataclass
+class Asset:
+    path: str
+    url_name: str
+    etag: str
+    size: int
+    mimetype: str
+    gzipped: Optional[bytes] = None
+
+
+class AssetManifest:
+    """Content hashes and fingerprinted names of every file in a folder"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.by_name: Dict[str, Asset] = {}
+        self.by_url: Dict[str, Asset] = {}
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for filename in files:
+                if not filename.startswith("."):
+                    self._add(os.path.join(root, filename))
+
+    def _add(self, path: str):
+        name = os.path.relpath(path, self.folder).replace(os.sep, "/")
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        etag = digest.hexdigest()[:16]
+
+        base, ext = os.path.splitext(name)
+        asset = Asset(
+            path=path,
+            url_name=f"{base}.{etag[:12]}{ext}",
+            etag=etag,
+            size=os.path.getsize(path),
+            mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream"
+        )
+        if ext in COMPRESSIBLE:
+            with open(path, "rb") as f:
+                asset.gzipped = gzip.compress(f.read(), compresslevel=9, mtime=0)
+        self.by_name[name] = asset
+        self.by_url[asset.url_name] = asset
+
+
+def init_assets(app):
+    """Hash the static folder and register /assets and the asset_url() template helper"""
+    app.extensions["assets"] = AssetManifest(app.static_folder)
+    app.register_blueprint(assets)
+    app.add_template_global(asset_url)
+
+
+def asset_url(filename: str) -> str:
+    """URL of a static file, fingerprinted with its content hash.
+
+    In debug mode, or for files added after startup, this is the plain
+    /static URL so edits show up without a restart.
+    """
+    asset = current_app.extensions["assets"].by_name.get(filename)
+    if asset is None or current_app.debug:
+        return url_for("static", filename=filename)
+    return url_for("assets.serve_asset", filename=asset.url_name)
+
+
+def _read_span(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _file_body(asset: Asset, start: int, length: int):
+    """Iterable over part of a file, zero-copy when the server supports it"""
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    # The server sends Content-Length bytes from the start of the file, so only
+    # spans beginning at byte 0 (which covers browsers' "bytes=0-") can use it
+    if file_wrapper is None or start:
+        return _read_span(asset.path, start, length)
+    return file_wrapper(open(asset.path, "rb"), CHUNK_SIZE)
+
+
+@assets.route("/assets/<path:filename>")
+def serve_asset(filename):
+    asset = current_app.extensions["assets"].by_url.get(filename)
+    if asset is None:
+        abort(404)
+
+    use_gzip = asset.gzipped is not None and "gzip" in request.accept_encodings
+    etag = asset.etag + "-gzip" if use_gzip else asset.etag
+
+    response = current_app.response_class(mimetype=asset.mimetype)
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.set_etag(etag)
+    if asset.gzipped is not None:
+        response.vary.add("Accept-Encoding")
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+
+    if use_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+        response.set_data(asset.gzipped)
+        return response
+
+    response.headers["Accept-Ranges"] = "bytes"
+    start, length = 0, asset.size
+
+    # Only honour a single range, and only if the client still has this version
+    byte_range = request.range
+    if_range = request.if_range
+    if (byte_range is not None and len(byte_range.ranges) == 1 and
+            not if_range.date and if_range.etag in (None, asset.etag)):
+        span = byte_range.range_for_length(asset.size)
+        if span is None:
+            response.status_code = 416
+            response.headers["Content-Range"] = f"bytes */{asset.size}"
+            return response
+        start, stop = span
+        length = stop - start
+        response.status_code = 206
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{asset.size}"
+
+    response.response = _file_body(asset, start, length)
+    response.direct_passthrough = True
+    response.headers["Content-Length"] = str(length)
+    return response
@@ -0,0 +1,467 @@
+"""World content (cities, riddles, events, characters, achievements) from a compiled pack.
+
+A world definition is a JSON file; `python content_pack.py export` writes
+the built-in content in that form to start from. `build` compiles it into
+a binary pack:
+
+    header    magic, format version, section count, SHA-256 of the sections
+    sections  name, offset and length of each:
+      coords  float64 latitude/longitude pairs, in city order
+      cities  one fixed-size record per city: (offset, length) of its
+              strings plus the difficulty
+      strings UTF-8 text the records point into, including each city's
+              riddle answers already normalised for checking
+      index   city numbers sorted by name, for binary-search lookups
+      meta    JSON: events, characters and achievements
+
+The app maps the pack read-only (CONTENT_PACK), so every worker shares
+the same pages, and decodes a city only when it is looked up. Workers
+notice a new pack within CHECK_INTERVAL seconds and switch to it between
+requests, then run the reload hooks (fragment caches, trigger tables).
+Build the new pack next to the old one and rename it into place; a
+worker still reading the old pack keeps its mapping until it lets go.
+
+    python content_pack.py export world.json
+    python content_pack.py build world.json instance/content.pack
+    python content_pack.py info instance/content.pack
+"""
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections.abc import Mapping, Sequence
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CVIPACK\0"
+FORMAT_VERSION = 1
+
+# Seconds a worker goes without checking whether the pack file was replaced
+CHECK_INTERVAL = 2.0
+
+_HEADER = struct.Struct("<8sII32s")
+_SECTION = struct.Struct("<8sQQ")
+# (offset, length) of name, description, riddle, riddle answer, synonyms and
+# normalised answers, then the difficulty
+_RECORD = struct.Struct("<12IH2x")
+_SEPARATOR = "\x1f"
+
+# Decoded cities kept per process before the cache starts over
+CITY_CACHE_SIZE = 4096
+
+
+def _section_name(name: str) -> bytes:
+    return name.encode("ascii").ljust(8, b"\0")
+
+
+def _content_version(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class BuiltinWorld:
+    """The content defined in game_content.py and game_mechanics.py"""
+
+    def __init__(self):
+        import game_content
+        import game_mechanics
+        self.cities = game_content.BUILTIN_CITIES
+        self.events = game_content.BUILTIN_EVENTS
+        self.characters = game_mechanics.BUILTIN_CHARACTERS
+        self.achievements = game_mechanics.BUILTIN_ACHIEVEMENTS
+        self._answers = {
+            name: frozenset(game_content.normalize_answer(answer)
+                            for answer in (city.riddle_answer,) + tuple(city.synonyms))
+            for name, city in self.cities.items()
+        }
+        self.version = "builtin-" + _content_version(self.cities, self.events, self.characters,
+                                                     self.achievements)
+
+    def answers(self, city_name: str) -> FrozenSet[str]:
+        return self._answers[city_name]
+
+    def city_coordinates(self) -> Dict[str, Tuple[float, float]]:
+        return {name: tuple(city.coordinates) for name, city in self.cities.items()}
+
+
+class PackCities(Mapping):
+    """Cities of a content pack, decoded on lookup"""
+
+    def __init__(self, pack: "ContentPack"):
+        self._pack = pack
+        self._cache = {}
+
+    def _name(self, number: int) -> bytes:
+        offset, length = _RECORD.unpack_from(self._pack.records, number * _RECORD.size)[:2]
+        return bytes(self._pack.strings[offset:offset + length])
+
+    def find(self, name: str) -> int:
+        """Number of the named city, or -1"""
+        key = name.encode("utf-8")
+        index = self._pack.index
+        low, high = 0, len(index)
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(index[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(index) and self._name(index[low]) == key:
+            return index[low]
+        return -1
+
+    def __getitem__(self, name: str):
+        city = self._cache.get(name)
+        if city is None:
+            number = self.find(name) if isinstance(name, str) else -1
+            if number < 0:
+                raise KeyError(name)
+            if len(self._cache) >= CITY_CACHE_SIZE:
+                self._cache.clear()
+            city = self._cache[name] = self._pack.city(number)
+        return city
+
+    def __contains__(self, name) -> bool:
+        return name in self._cache or (isinstance(name, str) and self.find(name) >= 0)
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self._name(number).decode("utf-8")
+
+    def __len__(self) -> int:
+        return self._pack.count
+
+
+class ContentPack:
+    """A compiled content pack, memory-mapped read-only"""
+
+    def __init__(self, path: str):
+        from game_content import City
+        from game_mechanics import Achievement, Character
+        self._city_class = City
+
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, digest = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} content pack")
+        body_start = _HEADER.size
+        if hashlib.sha256(memoryview(self._mmap)[body_start:]).digest() != digest:
+            raise ValueError(f"{path} is damaged or incomplete")
+
+        view = memoryview(self._mmap)
+        sections = {}
+        for i in range(count):
+            name, offset, length = _SECTION.unpack_from(self._mmap, body_start + i * _SECTION.size)
+            sections[name.rstrip(b"\0").decode("ascii")] = view[offset:offset + length]
+        self.coordinates = sections["coords"].cast("d")
+        self.records = sections["cities"]
+        self.strings = sections["strings"]
+        self.index = sections["index"].cast("I")
+        self.count = len(self.records) // _RECORD.size
+
+        meta = json.loads(bytes(sections["meta"]))
+        self.name = meta.get("name", "")
+        self.events = meta["events"]
+        self.characters = {key: Character(**fields) for key, fields in meta["characters"].items()}
+        self.achievements = {key: Achievement(**fields) for key, fields in meta["achievements"].items()}
+        self.cities = PackCities(self)
+        self.version = digest.hex()[:16]
+
+    def _text(self, offset: int, length: int) -> str:
+        return str(self.strings[offset:offset + length], "utf-8")
+
+    def city(self, number: int):
+        fields = _RECORD.unpack_from(self.records, number * _RECORD.size)
+        name, description, riddle, answer, synonyms = (self._text(*fields[i:i + 2])
+                                                       for i in range(0, 10, 2))
+        return self._city_class(
+            name=name,
+            coordinates=(self.coordinates[2 * number], self.coordinates[2 * number + 1]),
+            description=description,
+            riddle=riddle,
+            riddle_answer=answer,
+            difficulty=fields[12],
+            synonyms=tuple(synonyms.split(_SEPARATOR)) if synonyms else ()
+        )
+
+    def answers(self, city_name: str) -> FrozenSet[str]:
+        number = self.cities.find(city_name)
+        if number < 0:
+            raise KeyError(city_name)
+        offset, length = _RECORD.unpack_from(self.records, number * _RECORD.size)[10:12]
+        return frozenset(self._text(offset, length).split(_SEPARATOR))
+
+    def city_coordinates(self) -> Dict[str, Tuple[float, float]]:
+        return {name: (self.coordinates[2 * i], self.coordinates[2 * i + 1])
+                for i, name in enumerate(self.cities)}
+
+
+class ContentStore:
+    """The world the game is currently using, swapped atomically on reload"""
+
+    def __init__(self, check_interval: float = CHECK_INTERVAL):
+        self.path: Optional[str] = None
+        self.check_interval = check_interval
+        self._world = None
+        self._stat = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._hooks: List[Callable[[], None]] = []
+
+    @property
+    def world(self):
+        world = self._world
+        if world is None:
+            with self._lock:
+                if self._world is None:
+                    self._world = BuiltinWorld()
+                world = self._world
+        return world
+
+    def on_reload(self, hook: Callable[[], None]):
+        """Call hook after every switch to new content, e.g. to drop caches built from it"""
+        self._hooks.append(hook)
+        return hook
+
+    def use(self, path: Optional[str]):
+        """Serve content from the pack at path, and watch it for replacements"""
+        self.path = path
+        self.refresh(force=True)
+
+    def refresh(self, force: bool = False):
+        """Switch to a new pack if the file was replaced since the last check"""
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if key == self._stat:
+            return
+        with self._lock:
+            if key == self._stat:
+                return
+            try:
+                world = ContentPack(self.path)
+            except (OSError, ValueError, KeyError, TypeError):
+                logger.exception("Could not load content pack %s; keeping the current content",
+                                 self.path)
+                self._stat = key
+                return
+            self._world = world
+            self._stat = key
+        logger.warning("Loaded content pack %s (%s): %d cities", self.path, world.version,
+                       len(world.cities))
+        for hook in self._hooks:
+            hook()
+
+
+CONTENT = ContentStore()
+
+
+class LiveMapping(Mapping):
+    """A table of the current world (CITIES, CHARACTERS, ...) that follows reloads"""
+
+    def __init__(self, attribute: str):
+        self.attribute = attribute
+
+    def __getitem__(self, key):
+        return getattr(CONTENT.world, self.attribute)[key]
+
+    def __contains__(self, key) -> bool:
+        return key in getattr(CONTENT.world, self.attribute)
+
+    def __iter__(self):
+        return iter(getattr(CONTENT.world, self.attribute))
+
+    def __len__(self) -> int:
+        return len(getattr(CONTENT.world, self.attribute))
+
+    def __repr__(self) -> str:
+        # Fragment caches hash this, so it changes with the content
+        return f"<{self.attribute} of content {CONTENT.world.version}>"
+
+
+class LiveSequence(Sequence):
+    """A list of the current world (RANDOM_EVENTS) that follows reloads"""
+
+    def __init__(self, attribute: str):
+        self.attribute = attribute
+
+    def __getitem__(self, index):
+        return getattr(CONTENT.world, self.attribute)[index]
+
+    def __len__(self) -> int:
+        return len(getattr(CONTENT.world, self.attribute))
+
+    def __repr__(self) -> str:
+        return f"<{self.attribute} of content {CONTENT.world.version}>"
+
+
+def export_world(world=None) -> Dict:
+    """A world definition (the input of build_pack) of the given or built-in content"""
+    from dataclasses import asdict
+    world = world or BuiltinWorld()
+    return {
+        "name": getattr(world, "name", "builtin"),
+        "cities": [dict(asdict(city), coordinates=list(city.coordinates), synonyms=list(city.synonyms))
+                   for city in world.cities.values()],
+        "events": list(world.events),
+        "characters": {key: asdict(character) for key, character in world.characters.items()},
+        "achievements": {key: asdict(achievement) for key, achievement in world.achievements.items()},
+    }
+
+
+def validate_world(world: Dict):
+    """Raise ValueError if a world definition can't be played"""
+    from game_mechanics import ACHIEVEMENT_RULES
+    cities = world.get("cities") or []
+    if not cities:
+        raise ValueError("A world needs at least one city")
+    names = set()
+    for city in cities:
+        name = city.get("name")
+        if not isinstance(name, str) or not name or _SEPARATOR in name:
+            raise ValueError(f"Invalid city name {name!r}")
+        if name in names:
+            raise ValueError(f"Duplicate city {name!r}")
+        names.add(name)
+        lat, lon = city["coordinates"]
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"{name}: coordinates out of range")
+        if not 1 <= city.get("difficulty", 0) <= 5:
+            raise ValueError(f"{name}: difficulty must be 1-5")
+        for key in ("description", "riddle", "riddle_answer"):
+            if not isinstance(city.get(key), str):
+                raise ValueError(f"{name}: missing {key}")
+        if any(_SEPARATOR in synonym for synonym in city.get("synonyms", ())):
+            raise ValueError(f"{name}: invalid synonym")
+    for event in world.get("events", []):
+        if not event.get("title") or not event.get("choices"):
+            raise ValueError(f"Event {event.get('title')!r} needs a title and choices")
+        weights = [event.get("weight", 1), *event.get("regions", {}).values(),
+                   *event.get("characters", {}).values()]
+        if not all(isinstance(weight, (int, float)) and weight >= 0 for weight in weights):
+            raise ValueError(f"Event {event['title']!r}: weights must be non-negative numbers")
+    if not world.get("characters"):
+        raise ValueError("A world needs at least one character")
+    missing = {rule.key for rule in ACHIEVEMENT_RULES} - set(world.get("achievements", {}))
+    if missing:
+        raise ValueError(f"Missing achievements used by the rules: {', '.join(sorted(missing))}")
+
+
+def build_pack(world: Dict) -> bytes:
+    """Compile a world definition into a content pack"""
+    from game_content import normalize_answer
+    validate_world(world)
+    cities = world["cities"]
+
+    strings = bytearray()
+    interned = {}
+
+    def add(text: str) -> Tuple[int, int]:
+        span = interned.get(text)
+        if span is None:
+            data = text.encode("utf-8")
+            span = interned[text] = (len(strings), len(data))
+            strings.extend(data)
+        return span
+
+    coords = bytearray()
+    records = bytearray()
+    for city in cities:
+        synonyms = list(city.get("synonyms", ()))
+        answers = sorted({normalize_answer(answer) for answer in [city["riddle_answer"]] + synonyms})
+        spans = [add(city["name"]), add(city["description"]), add(city["riddle"]),
+                 add(city["riddle_answer"]), add(_SEPARATOR.join(synonyms)),
+                 add(_SEPARATOR.join(answers))]
+        records += _RECORD.pack(*(value for span in spans for value in span), city["difficulty"])
+        coords += struct.pack("<dd", *city["coordinates"])
+    order = sorted(range(len(cities)), key=lambda i: cities[i]["name"].encode("utf-8"))
+    index = struct.pack(f"<{len(order)}I", *order)
+    meta = json.dumps({key: world.get(key) for key in ("name", "events", "characters", "achievements")},
+                      ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    sections = [("coords", bytes(coords)), ("cities", bytes(records)), ("strings", bytes(strings)),
+                ("index", index), ("meta", meta)]
+    body = bytearray(_SECTION.size * len(sections))
+    offset = _HEADER.size + len(body)
+    for i, (name, data) in enumerate(sections):
+        # Keep the float64 and uint32 arrays aligned
+        padding = -offset % 8
+        body += b"\0" * padding
+        offset += padding
+        _SECTION.pack_into(body, i * _SECTION.size, _section_name(name), offset, len(data))
+        body += data
+        offset += len(data)
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), hashlib.sha256(body).digest()) + bytes(body)
+
+
+def write_pack(world: Dict, path: str):
+    """Compile a world and move it into place in one rename, so readers never see half a pack"""
+    data = build_pack(world)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def init_content(app):
+    """Load CONTENT_PACK, if set, and check for a new version before requests"""
+    CONTENT.use(app.config.get("CONTENT_PACK"))
+
+    @app.before_request
+    def refresh_content():
+        CONTENT.refresh()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Write the built-in content as a world definition")
+    export.add_argument("out")
+    build = commands.add_parser("build", help="Compile a world definition into a content pack")
+    build.add_argument("world")
+    build.add_argument("out")
+    info = commands.add_parser("info", help="Describe a content pack")
+    info.add_argument("pack")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(export_world(), f, indent=2, ensure_ascii=False)
+    elif args.command == "build":
+        with open(args.world, encoding="utf-8") as f:
+            world = json.load(f)
+        try:
+            write_pack(world, args.out)
+        except (KeyError, TypeError, ValueError) as e:
+            parser.error(f"Invalid world definition: {e}")
+        print(ContentPack(args.out).version)
+    else:
+        pack = ContentPack(args.pack)
+        print(json.dumps({"version": pack.version, "name": pack.name, "cities": pack.count,
+                          "events": len(pack.events), "characters": len(pack.characters),
+                          "achievements": len(pack.achievements),
+                          "bytes": os.path.getsize(args.pack)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Random events on the road between cities.
+
+Every step taken outside a city fires an event with probability
+EVENT_CHANCE. Which event is picked from the world's catalog depends on
+weights: each event can carry a base "weight" and multipliers for
+particular "regions" (the nearest city) and "characters":
+
+    {"title": ..., "choices": [...], "weight": 2,
+     "regions": {"Paris": 3}, "characters": {"noble": 0}}
+
+Picks use Vose's alias method, so choosing from a catalog of any size
+costs two random numbers. Only the regions and characters that some
+event mentions get a table of their own, so the number of tables stays
+small however many cities there are. A step that fires no event costs
+one random number.
+"""
+from typing import Dict, Optional, Sequence, Tuple
+
+# Probability that a step outside a city runs into an event
+EVENT_CHANCE = 0.01
+
+# How often a character's event_bonus_chance changes an outcome, and by how much
+BONUS_FACTOR = 1.5
+
+# Tables kept before the cache starts over
+MAX_TABLES = 1024
+
+# Effects that are good for the player when they increase / decrease
+FAVOURABLE_UP = ("stamina", "score")
+FAVOURABLE_DOWN = ("moves",)
+
+
+class AliasTable:
+    """Constant-time sampling of an index in proportion to a list of weights"""
+
+    def __init__(self, weights: Sequence[float]):
+        count = len(weights)
+        total = float(sum(weights))
+        if not count or total <= 0:
+            raise ValueError("Weights must include a positive value")
+        scaled = [weight * count / total for weight in weights]
+        self.probability = [1.0] * count
+        self.alias = list(range(count))
+        small = [i for i, weight in enumerate(scaled) if weight < 1.0]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Whatever is left is 1 up to rounding error and keeps its defaults
+
+    def __len__(self) -> int:
+        return len(self.probability)
+
+    def sample(self, rng) -> int:
+        column = int(rng.random() * len(self.probability))
+        return column if rng.random() < self.probability[column] else self.alias[column]
+
+
+class EventTrigger:
+    """Decides when an event fires and which one, for a catalog of events"""
+
+    def __init__(self, events: Sequence[Dict], chance: float = EVENT_CHANCE):
+        self.events = list(events)
+        self.chance = chance if self.events else 0.0
+        self.regions = {region for event in self.events for region in event.get("regions", ())}
+        self.characters = {key for event in self.events for key in event.get("characters", ())}
+        self._tables: Dict[Tuple[Optional[str], Optional[str]], Optional[AliasTable]] = {}
+
+    def _table(self, region: Optional[str], character: Optional[str]) -> Optional[AliasTable]:
+        # Regions and characters no event mentions all share the same weights
+        key = (region if region in self.regions else None,
+               character if character in self.characters else None)
+        try:
+            return self._tables[key]
+        except KeyError:
+            pass
+        weights = [event.get("weight", 1.0) *
+                   event.get("regions", {}).get(key[0], 1.0) *
+                   event.get("characters", {}).get(key[1], 1.0)
+                   for event in self.events]
+        table = AliasTable(weights) if any(weight > 0 for weight in weights) else None
+        if len(self._tables) >= MAX_TABLES:
+            self._tables.clear()
+        self._tables[key] = table
+        return table
+
+    def pick(self, rng, region: Optional[str], character: Optional[str]) -> Optional[Dict]:
+        """An event for a player near region, or None if none can happen there"""
+        table = self._table(region, character)
+        return self.events[table.sample(rng)] if table is not None else None
+
+    def roll(self, rng, region: Optional[str], character: Optional[str]) -> Optional[Dict]:
+        """The event a step runs into, if any"""
+        if rng.random() >= self.chance:
+            return None
+        return self.pick(rng, region, character)
+
+
+def public_event(event: Dict) -> Dict:
+    """An event as the client shows it, without the outcomes of its choices"""
+    return {"title": event["title"], "description": event.get("description", ""),
+            "choices": [{"text": choice["text"]} for choice in event["choices"]]}
+
+
+def apply_character_bonus(effect: Dict, bonus_chance: float, rng) -> Tuple[Dict, Optional[str]]:
+    """Let a character's event_bonus_chance improve (or, if negative, worsen) an outcome.
+
+    With probability abs(bonus_chance) the favourable parts of the effect
+    are scaled up by BONUS_FACTOR and the unfavourable parts down, or the
+    other way round for a negative chance. Returns the effect and
+    "favoured", "unfavoured" or None.
+    """
+    if not bonus_chance or rng.random() >= abs(bonus_chance):
+        return effect, None
+    lucky = bonus_chance > 0
+    effect = dict(effect)
+    for key, value in effect.items():
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        favourable = (key in FAVOURABLE_UP and value > 0) or (key in FAVOURABLE_DOWN and value < 0)
+        unfavourable = (key in FAVOURABLE_UP and value < 0) or (key in FAVOURABLE_DOWN and value > 0)
+        if favourable or unfavourable:
+            factor = BONUS_FACTOR if favourable == lucky else 1 / BONUS_FACTOR
+            effect[key] = type(value)(round(value * factor))
+    return effect, "favoured" if lucky else "unfavoured"
+
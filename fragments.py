@@ -0,0 +1,102 @@
+"""Per-process cache of rendered template fragments, plus ETag helpers for whole pages.
+
+Markup that only depends on the static game content (city lists,
+character cards, achievement blocks) is rendered once and reused by every
+request. Fragments are keyed on a content version that hashes the content
+itself, the templates and the static assets, so a deploy that changes any
+of them starts from a clean cache and hands out new ETags.
+"""
+import hashlib
+import json
+import os
+
+from flask import current_app, make_response, render_template, request
+from markupsafe import Markup
+
+
+def _freeze(value):
+    """Turn template arguments into something usable in a cache key"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+class FragmentCache:
+    # Drop everything rather than grow without bound if fragment keys explode
+    MAX_ENTRIES = 1024
+
+    def __init__(self, app, static_context):
+        self.app = app
+        self.static_context = static_context
+        self._fragments = {}
+        self.version = self.compute_version()
+
+    def compute_version(self) -> str:
+        """Hash the static content, the templates and the static assets"""
+        digest = hashlib.sha256()
+        for name in sorted(self.static_context):
+            digest.update(name.encode("utf-8"))
+            digest.update(repr(self.static_context[name]).encode("utf-8"))
+
+        template_folder = os.path.join(self.app.root_path, self.app.template_folder)
+        for root, _, files in sorted(os.walk(template_folder)):
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                digest.update(os.path.relpath(path, template_folder).encode("utf-8"))
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+
+        manifest = self.app.extensions.get("assets")
+        if manifest is not None:
+            for name in sorted(manifest.by_name):
+                digest.update(manifest.by_name[name].url_name.encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def reset(self):
+        """Forget every fragment, e.g. after the game content has been reloaded"""
+        self._fragments.clear()
+        self.version = self.compute_version()
+
+    def render(self, template_name: str, **context) -> Markup:
+        """Render a fragment template, reusing the result for identical arguments"""
+        if self.app.debug:
+            return self._render(template_name, context)
+
+        key = (self.version, template_name, _freeze(context))
+        html = self._fragments.get(key)
+        if html is None:
+            if len(self._fragments) >= self.MAX_ENTRIES:
+                self._fragments.clear()
+            html = self._fragments[key] = self._render(template_name, context)
+        return html
+
+    def _render(self, template_name, context):
+        template = self.app.jinja_env.get_template(template_name)
+        return Markup(template.render(**self.static_context, **context))
+
+    def etag(self, *parts) -> str:
+        """ETag for a page built from the current content version and some per-player data"""
+        digest = hashlib.sha256(self.version.encode("utf-8"))
+        digest.update(json.dumps(parts, sort_keys=True, default=str).encode("utf-8"))
+        return digest.hexdigest()[:24]
+
+
+def init_fragments(app, **static_context):
+    """Attach a fragment cache to the app and expose it to templates as fragment()"""
+    cache = FragmentCache(app, static_context)
+    app.extensions["fragments"] = cache
+    app.add_template_global(cache.render, "fragment")
+    return cache
+
+
+def render_conditional(etag: str, template_name: str, **context):
+    """Render a page with an ETag, or answer 304 without rendering if the client has it"""
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render_template(template_name, **context))
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
@@ -1,7 +1,12 @@
+import itertools
 import random
+import re
+import unicodedata
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Tuple
 
+from content_pack import CONTENT, LiveMapping, LiveSequence
+
 @dataclass
 class City:
     name: str
@@ -10,6 +15,7 @@ class City:
     riddle: str
     riddle_answer: str
     difficulty: int  # 1-5, increasing difficulty
+    synonyms: Tuple[str, ...] = ()  # Other accepted answers to the riddle
 
 @dataclass
 class Event:
@@ -17,15 +23,16 @@ class Event:
     description: str
     choices: List[Dict]
 
-# City definitions
-CITIES = {
+# Built-in city definitions, used unless a content pack is loaded (content_pack.py)
+BUILTIN_CITIES = {
     "London": City(
         name="London",
         coordinates=(51.5074, -0.1278),
         description="Hear ye hear ye welcom' t' Lodonon",
         riddle="I have a bed, but I do not sleep. I have a mouth, but I don't eat. You hear me whisper, but I never talk. You can see me run, I never walk. What am I?",
         riddle_answer="river",
-        difficulty=1
+        difficulty=1,
+        synonyms=("stream",)
     ),
     "Amsterdam": City(
         name="Amsterdam",
@@ -33,7 +40,8 @@ CITIES = {
         description="A city of canals and bicycles, where historic architecture meets modern life.",
         riddle="What has keys, but no locks; space, but no room; and you can enter, but not go in?",
         riddle_answer="keyboard",
-        difficulty=2
+        difficulty=2,
+        synonyms=("computer keyboard",)
     ),
     "Paris": City(
         name="Paris",
@@ -41,7 +49,8 @@ CITIES = {
         description="The City of Light, where art and culture flourish along the Seine.",
         riddle="I am always hungry; I must always be fed. The finger I touch, will soon turn red. What am I?",
         riddle_answer="fire",
-        difficulty=3
+        difficulty=3,
+        synonyms=("flame", "blaze")
     ),
     "Berlin": City(
         name="Berlin",
@@ -49,7 +58,8 @@ CITIES = {
         description="A city of history and renewal, where the past and present intertwine.",
         riddle="Who makes it, has no need of it. Who buys it, has no use for it. Who uses it can neither see nor feel it. What is it?",
         riddle_answer="coffin",
-        difficulty=4
+        difficulty=4,
+        synonyms=("casket",)
     ),
     "Geneva": City(
         name="Geneva",
@@ -57,12 +67,13 @@ CITIES = {
         description="A city of diplomacy and watchmaking, nestled by a beautiful lake.",
         riddle="I have a face but no eyes, hands but no arms. What am I?",
         riddle_answer="clock",
-        difficulty=5
+        difficulty=5,
+        synonyms=("watch", "wristwatch")
     )
 }
 
 # Random events that can occur during travel
-RANDOM_EVENTS = [
+BUILTIN_EVENTS = [
     {
         "title": "The Naked Sorcerer",
         "description": "A mysterious, completely unclothed sorcerer stands before you, holding a smoldering herb in one hand. 'Come, traveler,' he says, 'join me in the enchanted waters and cleanse your soul.'",
@@ -146,23 +157,77 @@ RANDOM_EVENTS = [
     }
 ]
 
+# The current world's cities and events; these follow content pack reloads
+CITIES = LiveMapping("cities")
+RANDOM_EVENTS = LiveSequence("events")
+
 def get_random_event():
     """Return a random event from the list of possible events"""
     return random.choice(RANDOM_EVENTS)
 
+# Leading words ignored when comparing answers ("a clock", "the river")
+ARTICLES = {"a", "an", "the", "some"}
+
+# Guesses longer than this can't match any answer and are rejected unread
+MAX_ANSWER_LENGTH = 64
+
+# Most guesses have no ambiguous plural; this bounds the ones that have many
+MAX_ANSWER_FORMS = 16
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def _singulars(word: str) -> Tuple[str, ...]:
+    """Possible singulars of a word under the regular English plural endings, likeliest first.
+
+    After a sibilant, "-es" may be the ending ("watches", "boxes") or "-s"
+    after a final "e" ("blazes", "axes"), so both are returned; a single
+    "z" more often comes from "ze".
+    """
+    if len(word) > 4 and word.endswith("ies"):
+        return (word[:-3] + "y",)
+    if len(word) > 3 and word.endswith("es") and word[:-2].endswith(("ch", "sh", "ss", "x", "z")):
+        without_es, without_s = word[:-2], word[:-1]
+        if word.endswith("zes") and not word.endswith("zzes"):
+            return without_s, without_es
+        return without_es, without_s
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return (word[:-1],)
+    return (word,)
+
+
+def _words(answer: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", answer).encode("ascii", "ignore").decode("ascii")
+    words = _NON_WORD.sub(" ", text.casefold()).split()
+    while len(words) > 1 and words[0] in ARTICLES:
+        words.pop(0)
+    return words
+
+
+def answer_forms(answer: str) -> List[str]:
+    """Every normalised form an answer could have, normalize_answer()'s first"""
+    choices = [_singulars(word) for word in _words(answer)]
+    return [" ".join(words) for words in itertools.islice(itertools.product(*choices), MAX_ANSWER_FORMS)]
+
+
+def normalize_answer(answer: str) -> str:
+    """Reduce an answer to the form stored in the answer index.
+
+    Accents and other Unicode variants are folded to plain ASCII, case and
+    punctuation are dropped, leading articles are skipped and plurals are
+    made singular, so "The Clocks!" and "clock" normalise the same way.
+    """
+    return " ".join(_singulars(word)[0] for word in _words(answer))
+
+
 def check_riddle_answer(city_name: str, answer: str) -> bool:
     """Check if the given answer matches the city's riddle answer."""
-    valid_answers = {
-        "clock": ["clock", "a clock", "the clock"],
-    }
-    
-    answer = answer.lower().strip()
-    correct_answer = CITIES[city_name].riddle_answer.lower()
-    
-    if correct_answer == "clock":
-        return answer in valid_answers["clock"]
-    
-    return answer == correct_answer
+    if len(answer) > MAX_ANSWER_LENGTH:
+        return False
+    # The current world keeps every city's accepted answers normalised; a
+    # plural like "blazes" is tried both as "blaze" and as "blaz"
+    answers = CONTENT.world.answers(city_name)
+    return any(form in answers for form in answer_forms(answer))
 
 def get_next_city(current_city: str, solved_cities: List[str]) -> str:
     """Get the next city to visit based on difficulty progression."""
@@ -0,0 +1,80 @@
+import atexit
+import hmac
+import logging
+import logging.handlers
+import queue
+
+from flask import request, session
+
+# Verbose game state dumps go through their own logger so they can be
+# switched on for a single request or session without lowering the level
+# of everything else
+STATE_LOGGER = logging.getLogger("app.state")
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"
+
+
+def configure_logging(app):
+    """Route all log records through a queue so formatting and I/O happen off the request thread"""
+    log_queue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler,
+                                              respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(app.config["LOG_LEVEL"])
+
+    # Dumps are already gated per request, so the logger itself lets them through
+    STATE_LOGGER.setLevel(logging.DEBUG)
+    return listener
+
+
+def tokens_match(supplied, expected):
+    """Compare a client-supplied secret in constant time.
+
+    Both sides are compared as UTF-8 bytes: compare_digest refuses str with
+    non-ASCII characters, and a header like that is just a wrong token.
+    Anything but a string (say a number in a JSON body) never matches.
+    """
+    if not (isinstance(supplied, str) and supplied and expected):
+        return False
+    return hmac.compare_digest(supplied.encode("utf-8"), expected.encode("utf-8"))
+
+
+def _token_matches(app, value):
+    return tokens_match(value, app.config.get("DEBUG_STATE_TOKEN"))
+
+
+def state_dumps_enabled(app):
+    """True if this request asked for verbose game state dumps.
+
+    Dumps are enabled with an X-Debug-State header carrying
+    DEBUG_STATE_TOKEN, or for a whole session via enable_state_dumps().
+    Without a configured token they are always off.
+    """
+    if not app.config.get("DEBUG_STATE_TOKEN"):
+        return False
+    return (_token_matches(app, request.headers.get("X-Debug-State")) or
+            session.get("debug_state", False))
+
+
+def enable_state_dumps(app, token, enabled=True):
+    """Turn state dumps on or off for the current session, returning False on a bad token"""
+    if not _token_matches(app, token):
+        return False
+    if enabled:
+        session["debug_state"] = True
+    else:
+        session.pop("debug_state", None)
+    return True
+
+
+def log_state(app, message, data):
+    """Dump a (potentially large) piece of game state if dumps are enabled"""
+    if state_dumps_enabled(app):
+        STATE_LOGGER.debug("%s: %r", message, data)
@@ -1,5 +1,7 @@
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
+
+from content_pack import LiveMapping
 
 @dataclass
 class Character:
@@ -13,7 +15,7 @@ class Character:
     deadly_event_chance: float = 0.0001  # 0.01% chance
     deadly_event: str = ""  # Description of the deadly event
 
-CHARACTERS = {
+BUILTIN_CHARACTERS = {
     "knight": Character(
         name="Random French guy",
         icon="🥖",
@@ -96,7 +98,7 @@ class Achievement:
     points: int
     achieved: bool = False
 
-ACHIEVEMENTS = {
+BUILTIN_ACHIEVEMENTS = {
     "first_riddle": Achievement(
         name="First Steps",
         description="Solve your first riddle",
@@ -129,38 +131,39 @@ ACHIEVEMENTS = {
     )
 }
 
+# The current world's characters and achievements; these follow content pack reloads
+CHARACTERS = LiveMapping("characters")
+ACHIEVEMENTS = LiveMapping("achievements")
+
 def calculate_efficiency_bonus(total_distance: float) -> int:
     """Calculate bonus points based on total distance traveled"""
     return max(0, int((1000 - total_distance) * 0.5))
 
+@dataclass(frozen=True)
+class AchievementRule:
+    key: str  # key in ACHIEVEMENTS
+    depends_on: Tuple[str, ...]  # game state fields whose changes can unlock it
+    condition: Callable[[Dict], bool]
+
+ACHIEVEMENT_RULES = [
+    AchievementRule("first_riddle", ("riddles_solved",),
+                    lambda state: len(state["riddles_solved"]) >= 1),
+    # last_riddle_moves: moves taken since the previous riddle (or the start)
+    AchievementRule("speed_solver", ("last_riddle_moves",),
+                    lambda state: len(state["riddles_solved"]) >= 1 and state["last_riddle_moves"] < 10),
+    AchievementRule("all_cities", ("riddles_solved",),
+                    lambda state: len(state["riddles_solved"]) >= state["total_cities"]),
+    # Only a finished quest counts: every riddle solved and the château reached
+    AchievementRule("efficient_route", ("game_completed",),
+                    lambda state: (state["game_completed"] and state.get("at_chateau", False) and
+                                   len(state["riddles_solved"]) >= state["total_cities"] and
+                                   state["moves"] < 100)),
+    AchievementRule("event_master", ("successful_events",),
+                    lambda state: state.get("successful_events", 0) >= 3),
+]
+
 def check_achievements(game_state: Dict) -> List[Achievement]:
-    """Check and return newly achieved achievements"""
-    new_achievements = []
+    """Check every rule and return the achievements earned but not yet unlocked"""
     achievements = game_state.get("achievements", {})
-    
-    # First riddle achievement
-    if (len(game_state["riddles_solved"]) >= 1 and 
-        not achievements.get("first_riddle", {}).get("achieved")):
-        new_achievements.append(ACHIEVEMENTS["first_riddle"])
-    
-    # Speed solver achievement
-    if (game_state.get("last_riddle_moves", 100) < 10 and 
-        not achievements.get("speed_solver", {}).get("achieved")):
-        new_achievements.append(ACHIEVEMENTS["speed_solver"])
-    
-    # All cities achievement
-    if (len(game_state["riddles_solved"]) == game_state["total_cities"] and 
-        not achievements.get("all_cities", {}).get("achieved")):
-        new_achievements.append(ACHIEVEMENTS["all_cities"])
-    
-    # Efficient route achievement
-    if (game_state["moves"] < 100 and len(game_state["riddles_solved"]) > 0 and 
-        not achievements.get("efficient_route", {}).get("achieved")):
-        new_achievements.append(ACHIEVEMENTS["efficient_route"])
-    
-    # Event master achievement
-    if (game_state.get("successful_events", 0) >= 3 and 
-        not achievements.get("event_master", {}).get("achieved")):
-        new_achievements.append(ACHIEVEMENTS["event_master"])
-    
-    return new_achievements 
\ No newline at end of file
+    return [ACHIEVEMENTS[rule.key] for rule in ACHIEVEMENT_RULES
+            if not achievements.get(rule.key, {}).get("achieved") and rule.condition(game_state)]
@@ -0,0 +1,268 @@
+"""Compact, slotted game state with a versioned binary encoding.
+
+GameState keeps the fields every player has in __slots__ instead of a
+per-session dict, and behaves like the dict it replaces
+(game_state["moves"] += 1, .get(), .update(), "key" in game_state), so the
+game rules update it in place. Rare keys set by events and the château
+logic live in a small overflow dict.
+
+encode() packs the state into a few hundred bytes: fixed-width numbers,
+length-prefixed strings and a short JSON tail for the free-form parts. The
+first byte is the format version, so stored sessions stay readable when
+the layout changes. TagGameState lets Flask's tagged JSON session
+serializer store a GameState as one field.
+"""
+import json
+import math
+import struct
+from base64 import b64decode, b64encode
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional
+
+from flask.json.tag import JSONTag
+
+from game_content import CITIES
+
+FORMAT_VERSION = 3
+
+# Keys of the score dict, in the order they are packed
+SCORE_KEYS = ("total", "riddles_solved", "efficiency_bonus", "wrong_answers", "achievements", "events")
+
+# moves, last_riddle_moves, total_cities, flags, stamina, total_distance, lat, lon, score
+_NUMBERS = struct.Struct("<iiHBdddd6i")
+# Earlier formats packed fewer score keys: 1 had no achievements, 2 no events
+_NUMBERS_BY_VERSION = {
+    1: struct.Struct("<iiHBdddd4i"),
+    2: struct.Struct("<iiHBdddd5i"),
+    FORMAT_VERSION: _NUMBERS,
+}
+_COUNT = struct.Struct("<H")
+_INT = struct.Struct("<i")
+_NONE = 0xFFFF
+
+# Bits of the flags byte
+_GAME_COMPLETED = 1
+_IN_CITY = 2
+_HAS_DIED = 4
+_HAS_POSITION = 8
+# current_riddle is the riddle of current_city and is not stored
+_CITY_RIDDLE = 16
+
+
+def _pack_str(out: bytearray, value: Optional[str]):
+    if value is None:
+        out += _COUNT.pack(_NONE)
+        return
+    data = value.encode("utf-8")
+    if len(data) >= _NONE:
+        raise ValueError("String too long to encode")
+    out += _COUNT.pack(len(data))
+    out += data
+
+
+def _unpack_str(data: bytes, offset: int):
+    (length,), offset = _COUNT.unpack_from(data, offset), offset + _COUNT.size
+    if length == _NONE:
+        return None, offset
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+
+class GameState(MutableMapping):
+    """One player's game state: slots for the common fields, a dict for the rest"""
+
+    FIELDS = (
+        "current_city", "moves", "riddles_solved", "game_completed", "player_position",
+        "current_riddle", "in_city", "companions", "character", "player_name", "score",
+        "achievements", "total_distance", "last_riddle_moves", "total_cities", "stamina",
+        "wrong_answers", "has_died", "death_message",
+    )
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, data: Optional[Dict] = None, **kwargs):
+        self.current_city = None
+        self.moves = 0
+        self.riddles_solved = []
+        self.game_completed = False
+        self.player_position = None
+        self.current_riddle = None
+        self.in_city = False
+        self.companions = []
+        self.character = None
+        self.player_name = None
+        self.score = dict.fromkeys(SCORE_KEYS, 0)
+        self.achievements = {}
+        self.total_distance = 0.0
+        self.last_riddle_moves = 0
+        self.total_cities = len(CITIES)
+        self.stamina = 100.0
+        self.wrong_answers = {}
+        self.has_died = False
+        self.death_message = ""
+        self.extra = {}
+        self.update(data or {}, **kwargs)
+
+    # Mapping protocol
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELDS:
+            return getattr(self, key)
+        return self.extra[key]
+
+    def __setitem__(self, key: str, value: Any):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key: str):
+        if key in self.FIELDS:
+            raise KeyError(f"{key} is always part of the game state")
+        del self.extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.FIELDS
+        yield from self.extra
+
+    def __len__(self) -> int:
+        return len(self.FIELDS) + len(self.extra)
+
+    def __contains__(self, key) -> bool:
+        return key in self.FIELDS or key in self.extra
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, GameState):
+            return self.to_dict() == other.to_dict()
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"GameState({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict:
+        """Plain dict copy of the state, for JSON responses"""
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data.update(self.extra)
+        return data
+
+    # Binary encoding
+
+    def encode(self) -> bytes:
+        flags = 0
+        if self.game_completed:
+            flags |= _GAME_COMPLETED
+        if self.in_city:
+            flags |= _IN_CITY
+        if self.has_died:
+            flags |= _HAS_DIED
+        lat = lon = math.nan
+        if self.player_position:
+            flags |= _HAS_POSITION
+            lat, lon = self.player_position
+        city = CITIES.get(self.current_city) if self.current_city else None
+        if self.current_riddle is not None and city is not None and self.current_riddle == city.riddle:
+            flags |= _CITY_RIDDLE
+
+        # Anything that doesn't fit the fixed layout goes into the JSON tail
+        tail = {}
+        if self.extra:
+            tail["extra"] = self.extra
+        if self.achievements:
+            tail["achievements"] = self.achievements
+        standard_score = (set(self.score) == set(SCORE_KEYS) and
+                          all(type(self.score[key]) is int for key in SCORE_KEYS))
+        if not standard_score:
+            tail["score"] = self.score
+
+        out = bytearray([FORMAT_VERSION])
+        out += _NUMBERS.pack(
+            self.moves, self.last_riddle_moves, self.total_cities, flags,
+            self.stamina, self.total_distance, lat, lon,
+            *(self.score[key] if standard_score else 0 for key in SCORE_KEYS))
+        _pack_str(out, self.current_city)
+        _pack_str(out, None if flags & _CITY_RIDDLE else self.current_riddle)
+        _pack_str(out, self.character)
+        _pack_str(out, self.player_name)
+        _pack_str(out, self.death_message)
+        for names in (self.riddles_solved, self.companions):
+            out += _COUNT.pack(len(names))
+            for name in names:
+                _pack_str(out, name)
+        out += _COUNT.pack(len(self.wrong_answers))
+        for city_name, count in self.wrong_answers.items():
+            _pack_str(out, city_name)
+            out += _INT.pack(count)
+        if tail:
+            out += json.dumps(tail, separators=(",", ":")).encode("utf-8")
+        return bytes(out)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "GameState":
+        numbers = _NUMBERS_BY_VERSION.get(data[0]) if data else None
+        if numbers is None:
+            raise ValueError(f"Unsupported game state format: {data[:1]!r}")
+
+        state = cls.__new__(cls)
+        (state.moves, state.last_riddle_moves, state.total_cities, flags,
+         state.stamina, state.total_distance, lat, lon,
+         *score) = numbers.unpack_from(data, 1)
+        offset = 1 + numbers.size
+        state.score = dict.fromkeys(SCORE_KEYS, 0)
+        state.score.update(zip(SCORE_KEYS, score))
+        state.game_completed = bool(flags & _GAME_COMPLETED)
+        state.in_city = bool(flags & _IN_CITY)
+        state.has_died = bool(flags & _HAS_DIED)
+        state.player_position = [lat, lon] if flags & _HAS_POSITION else None
+
+        state.current_city, offset = _unpack_str(data, offset)
+        state.current_riddle, offset = _unpack_str(data, offset)
+        if flags & _CITY_RIDDLE:
+            # The city can be gone if the content was reloaded since
+            city = CITIES.get(state.current_city)
+            state.current_riddle = city.riddle if city is not None else None
+        state.character, offset = _unpack_str(data, offset)
+        state.player_name, offset = _unpack_str(data, offset)
+        state.death_message, offset = _unpack_str(data, offset)
+
+        lists = []
+        for _ in range(2):
+            (count,), offset = _COUNT.unpack_from(data, offset), offset + _COUNT.size
+            names = []
+            for _ in range(count):
+                name, offset = _unpack_str(data, offset)
+                names.append(name)
+            lists.append(names)
+        state.riddles_solved, state.companions = lists
+
+        (count,), offset = _COUNT.unpack_from(data, offset), offset + _COUNT.size
+        state.wrong_answers = {}
+        for _ in range(count):
+            city_name, offset = _unpack_str(data, offset)
+            state.wrong_answers[city_name] = _INT.unpack_from(data, offset)[0]
+            offset += _INT.size
+
+        tail = json.loads(data[offset:]) if offset < len(data) else {}
+        state.extra = tail.get("extra", {})
+        state.achievements = tail.get("achievements", {})
+        if "score" in tail:
+            state.score = tail["score"]
+        return state
+
+
+class TagGameState(JSONTag):
+    """Store a GameState in a tagged JSON session as its base64-encoded binary form"""
+
+    __slots__ = ()
+    key = " gs"
+
+    def check(self, value) -> bool:
+        return isinstance(value, GameState)
+
+    def to_json(self, value: GameState) -> str:
+        return b64encode(value.encode()).decode("ascii")
+
+    def to_python(self, value: str) -> GameState:
+        return GameState.decode(b64decode(value))
+
+
+def register_session_tag(serializer):
+    """Teach a Flask TaggedJSONSerializer (a session interface's serializer) about GameState"""
+    serializer.register(TagGameState, force=True)
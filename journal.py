@@ -0,0 +1,312 @@
+"""Append-only journal of every game action, with snapshots and replay.
+
+Each action that changes a game (start, move, riddle attempt, event
+choice, location check, completion, and the tick engine's position syncs)
+is appended to the journal as one JSON line:
+
+    {"t": time, "g": game id, "n": sequence number within the game,
+     "a": action, "d": payload, "r": random seed}
+
+Moves and event choices run on a random generator seeded per action, so
+replaying the journal reproduces every die roll. Every SNAPSHOT_EVERY
+actions the whole game state is written too, so one game can be rebuilt
+without reading its full history.
+
+Records are queued and written by a background thread in group commits
+(one write and one fsync per batch), so a request never waits on the
+disk. Each process writes its own segment files, which roll over at
+SEGMENT_BYTES.
+
+    python journal.py replay <game id>          # rebuild one game
+    python journal.py leaderboard --out scores.sqlite3   # re-score everything
+    python journal.py stats
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from base64 import b64decode, b64encode
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Dict, Iterator, List, Optional
+
+import game_actions
+from content_pack import CONTENT
+from game_state import GameState
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_BYTES = 8 * 1024 * 1024
+
+# Write a full snapshot of a game every this many actions
+SNAPSHOT_EVERY = 100
+
+# Actions that draw random numbers, and so are replayed with a recorded seed
+SEEDED_ACTIONS = {"move", "handle_event"}
+
+
+class Journal:
+    """Per-process writer of journal segments"""
+
+    def __init__(self, directory: str, batch_size: int = 1000, flush_interval: float = 0.05,
+                 segment_bytes: int = SEGMENT_BYTES, snapshot_every: int = SNAPSHOT_EVERY,
+                 fsync: bool = True):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self._queue: "queue.Queue[Dict]" = queue.Queue()
+        self._segment = None
+        self._pid = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._write_loop, name="journal-writer",
+                                        daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def record(self, game_state, action: str, payload=None, seed: Optional[int] = None):
+        """Queue one action of a game; games started before the journal existed are skipped"""
+        game_id = game_state.get("game_id") if game_state else None
+        if not game_id:
+            return
+        sequence = game_state.get("journal_seq", 0) + 1
+        game_state["journal_seq"] = sequence
+        now = time.time()
+        self._queue.put({"t": now, "g": game_id, "n": sequence, "a": action,
+                         "d": payload, "r": seed})
+        if sequence % self.snapshot_every == 0:
+            self._queue.put({"t": now, "g": game_id, "n": sequence, "a": "snapshot",
+                             "d": b64encode(GameState(game_state).encode()).decode("ascii")})
+
+    def flush(self):
+        """Block until every queued record has been written"""
+        self._queue.join()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            try:
+                self._write_batch(batch)
+            except (OSError, TypeError, ValueError):
+                logger.exception("Error writing journal batch of %d records", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: List[Dict]):
+        data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in batch)
+        segment = self._open_segment()
+        segment.write(data.encode("utf-8"))
+        segment.flush()
+        if self.fsync:
+            os.fsync(segment.fileno())
+
+    def _open_segment(self):
+        # A forked worker must not append to its parent's segment
+        if (self._segment is None or self._pid != os.getpid() or
+                self._segment.tell() >= self.segment_bytes):
+            if self._segment is not None and self._pid == os.getpid():
+                self._segment.close()
+            self._pid = os.getpid()
+            name = f"{time.time_ns():020d}-{self._pid}.jsonl"
+            self._segment = open(os.path.join(self.directory, name), "ab")
+        return self._segment
+
+
+def journaled_actions(journal: Journal, leaderboard) -> Dict:
+    """Game actions by name, each recording itself in the journal when it succeeds"""
+    actions = {
+        "move": game_actions.move,
+        "solve_riddle": game_actions.solve_riddle,
+        "handle_event": game_actions.handle_event,
+        "check_location": game_actions.check_location,
+        "complete_game": partial(game_actions.complete_game, leaderboard=leaderboard),
+    }
+    return {name: _journaled(name, action, journal) for name, action in actions.items()}
+
+
+def _journaled(name, action, journal):
+    seeded = name in SEEDED_ACTIONS
+
+    def run(session, data):
+        seed = random.getrandbits(32) if seeded else None
+        if seeded:
+            response, status = action(session, data, rng=random.Random(seed))
+        else:
+            response, status = action(session, data)
+        if status == 200:
+            journal.record(session.get("game_state"), name,
+                           dict(data) if data is not None else None, seed)
+        return response, status
+
+    run.__name__ = name
+    return run
+
+
+def read_records(directory: str) -> Iterator[Dict]:
+    """Every record in the journal, segment by segment"""
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A crash can leave a half-written last line
+                    logger.warning("Skipping damaged journal record in %s", name)
+
+
+def load_games(directory: str, game_id: Optional[str] = None) -> Dict[str, List[Dict]]:
+    """Records grouped by game, in the order they happened"""
+    games = defaultdict(list)
+    for record in read_records(directory):
+        if game_id is None or record["g"] == game_id:
+            games[record["g"]].append(record)
+    for records in games.values():
+        # Snapshots sort after the action they were taken with
+        records.sort(key=lambda record: (record["n"], record["a"] == "snapshot"))
+    return games
+
+
+class ReplayLeaderboard:
+    """Collects the scores a replay submits instead of writing them anywhere"""
+
+    def __init__(self):
+        self.entries = []
+        self.date = None
+
+    def rank(self, score):
+        return 0
+
+    def submit(self, entry):
+        # Keep the date the game was really completed
+        self.entries.append(dict(entry, date=self.date))
+
+
+def replay_game(records: List[Dict], use_snapshots: bool = True, leaderboard=None):
+    """Rebuild a game's state from its records.
+
+    With use_snapshots the replay starts from the latest snapshot; without,
+    every action is re-run, which re-scores the game under the current rules.
+    """
+    leaderboard = leaderboard or ReplayLeaderboard()
+    start = 0
+    session = {"game_state": game_actions.new_game_state()}
+    if use_snapshots:
+        for index in range(len(records) - 1, -1, -1):
+            if records[index]["a"] == "snapshot":
+                session["game_state"] = GameState.decode(b64decode(records[index]["d"]))
+                start = index + 1
+                break
+
+    for record in records[start:]:
+        action, data = record["a"], record["d"]
+        game_state = session["game_state"]
+        if action == "snapshot":
+            continue
+        if action == "start":
+            session["game_state"] = game_state = game_actions.new_game_state()
+            game_state.update(data)
+        elif action == "sync":
+            game_state.update(data)
+        elif action == "move":
+            game_actions.move(session, data, rng=random.Random(record["r"]))
+        elif action == "handle_event":
+            game_actions.handle_event(session, data, rng=random.Random(record["r"]))
+        elif action == "complete_game":
+            leaderboard.date = datetime.fromtimestamp(record["t"]).strftime("%Y-%m-%d %H:%M:%S")
+            game_actions.complete_game(session, data, leaderboard)
+        else:
+            game_actions.ACTIONS[action](session, data)
+        session["game_state"]["journal_seq"] = record["n"]
+    return session["game_state"], leaderboard.entries
+
+
+def _replay_games(games: List[List[Dict]], use_snapshots: bool):
+    leaderboard = ReplayLeaderboard()
+    for records in games:
+        replay_game(records, use_snapshots, leaderboard)
+    return leaderboard.entries
+
+
+def replay_all(directory: str, workers: Optional[int] = None, use_snapshots: bool = False) -> Dict:
+    """Re-run every game in the journal, in parallel, and collect the scores they submit"""
+    start = time.perf_counter()
+    games = list(load_games(directory).values())
+    events = sum(len(records) for records in games)
+    workers = workers or os.cpu_count() or 1
+    chunks = [games[i::workers] for i in range(workers) if games[i::workers]]
+
+    entries = []
+    if len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+            for chunk_entries in pool.map(partial(_replay_games, use_snapshots=use_snapshots), chunks):
+                entries.extend(chunk_entries)
+    elif chunks:
+        entries = _replay_games(chunks[0], use_snapshots)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "games": len(games),
+        "events": events,
+        "seconds": round(elapsed, 2),
+        "events_per_second": round(events / elapsed) if elapsed else 0,
+        "entries": entries
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default=os.environ.get("JOURNAL_DIR", os.path.join("instance", "journal")),
+                        help="Journal directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay = commands.add_parser("replay", help="Rebuild one game's state")
+    replay.add_argument("game_id")
+    replay.add_argument("--full", action="store_true", help="Ignore snapshots and re-run everything")
+    rescore = commands.add_parser("leaderboard", help="Re-run every game and rebuild a leaderboard")
+    rescore.add_argument("--out", required=True, help="SQLite file for the rebuilt leaderboard")
+    rescore.add_argument("--workers", type=int, default=None)
+    commands.add_parser("stats", help="Count games and records")
+    args = parser.parse_args()
+
+    # Replay against the same world the server is using
+    CONTENT.use(os.environ.get("CONTENT_PACK"))
+
+    if args.command == "replay":
+        records = load_games(args.dir, args.game_id).get(args.game_id)
+        if not records:
+            parser.error(f"No records for game {args.game_id}")
+        game_state, _ = replay_game(records, use_snapshots=not args.full)
+        print(json.dumps(game_state.to_dict(), indent=2, default=str))
+    elif args.command == "leaderboard":
+        from leaderboard import Leaderboard
+        result = replay_all(args.dir, args.workers)
+        board = Leaderboard(args.out)
+        for entry in result.pop("entries"):
+            board.submit(entry)
+        board.flush()
+        print(json.dumps(result))
+    else:
+        games = load_games(args.dir)
+        print(json.dumps({"games": len(games),
+                          "records": sum(len(records) for records in games.values())}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Key used in the aggregate tables for the board that spans every character
+ALL_CHARACTERS = ""
+
+# Scores are counted in a Fenwick tree over this many slots, centred on zero;
+# scores beyond the range share the end slots
+SCORE_SLOTS = 1 << 20
+SCORE_OFFSET = SCORE_SLOTS // 2
+
+
+def _slot(score: int) -> int:
+    """The tree's 1-based slot for a score"""
+    return min(max(score + SCORE_OFFSET, 0), SCORE_SLOTS - 1) + 1
+
+
+def _update_nodes(score: int) -> List[int]:
+    """Tree nodes whose counts include a score"""
+    nodes, node = [], _slot(score)
+    while node <= SCORE_SLOTS:
+        nodes.append(node)
+        node += node & -node
+    return nodes
+
+
+def _prefix_nodes(score: int) -> List[int]:
+    """Tree nodes that add up to the number of scores at or below a score"""
+    nodes, node = [], _slot(score)
+    while node:
+        nodes.append(node)
+        node -= node & -node
+    return nodes
+
+
+class Leaderboard:
+    """Global leaderboard kept in SQLite and shared by every worker.
+
+    Completed games are queued and written by a background thread in
+    batched transactions, so recording a score never waits on the disk.
+    Top-N queries walk the score index, and rank lookups read about twenty
+    rows of a Fenwick tree of score counts instead of counting every score
+    above the one asked about.
+    """
+
+    def __init__(self, path: str, batch_size: int = 200, flush_interval: float = 0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._queue: "queue.Queue[Dict]" = queue.Queue()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS scores (
+                    id INTEGER PRIMARY KEY,
+                    player_name TEXT NOT NULL,
+                    character TEXT NOT NULL,
+                    score INTEGER NOT NULL,
+                    moves INTEGER NOT NULL,
+                    cities_visited INTEGER NOT NULL,
+                    total_cities INTEGER NOT NULL,
+                    total_distance REAL NOT NULL,
+                    date TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS scores_by_score ON scores (score DESC, id);
+                CREATE INDEX IF NOT EXISTS scores_by_character
+                    ON scores (character, score DESC, id);
+                CREATE INDEX IF NOT EXISTS scores_by_player ON scores (player_name, score DESC);
+                CREATE TABLE IF NOT EXISTS score_tree (
+                    character TEXT NOT NULL,
+                    node INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (character, node)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS board_totals (
+                    character TEXT PRIMARY KEY,
+                    games INTEGER NOT NULL,
+                    score_sum INTEGER NOT NULL,
+                    moves_sum INTEGER NOT NULL,
+                    distance_sum REAL NOT NULL
+                );
+                DROP TABLE IF EXISTS score_counts;
+            """)
+            # Boards written before the tree existed are counted into it once; the
+            # write lock keeps workers starting together from both doing it
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM score_tree LIMIT 1").fetchone() is None:
+                self._count_scores(conn, conn.execute("SELECT character, score FROM scores"))
+
+        self._writer = threading.Thread(target=self._write_loop, name="leaderboard-writer",
+                                        daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(self, entry: Dict):
+        """Queue a finished game for the background writer"""
+        self._queue.put(entry)
+
+    def flush(self):
+        """Block until every queued entry has been written"""
+        self._queue.join()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            try:
+                self._write_batch(batch)
+            except Exception:
+                # Keep the writer alive: flush() waits on every queued entry
+                logger.exception("Error writing leaderboard batch of %d entries", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: List[Dict]):
+        conn = self._connect()
+        with conn:
+            conn.executemany("""
+                INSERT INTO scores (player_name, character, score, moves, cities_visited,
+                                    total_cities, total_distance, date)
+                VALUES (:player_name, :character, :score, :moves, :cities_visited,
+                        :total_cities, :total_distance, :date)
+            """, batch)
+            self._count_scores(conn, ((entry["character"], entry["score"]) for entry in batch))
+            for entry in batch:
+                for character in (ALL_CHARACTERS, entry["character"]):
+                    conn.execute("""
+                        INSERT INTO board_totals (character, games, score_sum, moves_sum,
+                                                  distance_sum)
+                        VALUES (?, 1, ?, ?, ?)
+                        ON CONFLICT (character) DO UPDATE SET
+                            games = games + 1,
+                            score_sum = score_sum + excluded.score_sum,
+                            moves_sum = moves_sum + excluded.moves_sum,
+                            distance_sum = distance_sum + excluded.distance_sum
+                    """, (character, entry["score"], entry["moves"], entry["total_distance"]))
+
+    @staticmethod
+    def _count_scores(conn: sqlite3.Connection, scores):
+        """Add (character, score) pairs to the score tree"""
+        counts: Dict = {}
+        for character, score in scores:
+            for node in _update_nodes(score):
+                for key in ((ALL_CHARACTERS, node), (character, node)):
+                    counts[key] = counts.get(key, 0) + 1
+        conn.executemany("""
+            INSERT INTO score_tree (character, node, count) VALUES (?, ?, ?)
+            ON CONFLICT (character, node) DO UPDATE SET count = count + excluded.count
+        """, [(character, node, count) for (character, node), count in counts.items()])
+
+    def top(self, limit: int = 10, character: Optional[str] = None) -> List[Dict]:
+        """Return the best scores, optionally for a single character"""
+        conn = self._connect()
+        if character:
+            rows = conn.execute(
+                "SELECT * FROM scores WHERE character = ? ORDER BY score DESC, id LIMIT ?",
+                (character, limit))
+        else:
+            rows = conn.execute("SELECT * FROM scores ORDER BY score DESC, id LIMIT ?", (limit,))
+        return [dict(row) for row in rows]
+
+    def rank(self, score: int, character: Optional[str] = None) -> int:
+        """Return the rank a score holds (1 is best) on the global or a character board"""
+        character = character or ALL_CHARACTERS
+        nodes = _prefix_nodes(score)
+        row = self._connect().execute(
+            "SELECT (SELECT COALESCE(MAX(games), 0) FROM board_totals WHERE character = ?), "
+            "(SELECT COALESCE(SUM(count), 0) FROM score_tree WHERE character = ? AND node IN "
+            f"({', '.join('?' * len(nodes))}))",
+            (character, character, *nodes)).fetchone()
+        # Games minus the scores at or below this one
+        return row[0] - row[1] + 1
+
+    def player_rank(self, player_name: str, character: Optional[str] = None) -> Optional[int]:
+        """Return the rank of a player's best score, or None if they have no score"""
+        conn = self._connect()
+        if character:
+            row = conn.execute(
+                "SELECT MAX(score) FROM scores WHERE player_name = ? AND character = ?",
+                (player_name, character)).fetchone()
+        else:
+            row = conn.execute("SELECT MAX(score) FROM scores WHERE player_name = ?",
+                               (player_name,)).fetchone()
+        if row[0] is None:
+            return None
+        return self.rank(row[0], character)
+
+    def stats(self, character: Optional[str] = None) -> Dict:
+        """Return the number of games and average score, moves and distance"""
+        row = self._connect().execute(
+            "SELECT games, score_sum, moves_sum, distance_sum FROM board_totals "
+            "WHERE character = ?", (character or ALL_CHARACTERS,)).fetchone()
+        if row is None or not row["games"]:
+            return {"games": 0, "average_score": 0, "average_moves": 0, "average_distance": 0}
+        return {
+            "games": row["games"],
+            "average_score": round(row["score_sum"] / row["games"]),
+            "average_moves": round(row["moves_sum"] / row["games"]),
+            "average_distance": round(row["distance_sum"] / row["games"], 1)
+        }
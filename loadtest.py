@@ -0,0 +1,423 @@
+"""Load generator and benchmark suite for the game endpoints.
+
+Simulated players start a game at "/", then play bursts of /move,
+/check_location, /solve_riddle and /handle_event before finishing with
+/complete_game. Requests go through the Flask test client by default, or
+to a running server with --url:
+
+    python loadtest.py --players 20 --duration 30
+    python loadtest.py --url http://127.0.0.1:8000 --players 200 --duration 60
+
+Results (throughput, p50/p95/p99 latency per route and micro-benchmarks of
+the movement and nearest-city code) can be saved as a JSON baseline and
+compared against later runs, which exit non-zero on a regression:
+
+    python loadtest.py --save baselines/local.json
+    python loadtest.py --compare baselines/local.json --tolerance 0.25
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
+
+ROUTES = ["/", "/move", "/check_location", "/solve_riddle", "/handle_event", "/complete_game"]
+
+PERCENTILES = (50, 95, 99)
+
+# Share of riddle guesses a simulated player gets right
+CORRECT_ANSWER_RATE = 0.5
+
+
+class TestClientTarget:
+    """Drives the app in-process through Flask's test client"""
+
+    def __init__(self):
+        # Keep load-test sessions and scores out of the real databases
+        data_dir = tempfile.mkdtemp(prefix="loadtest-")
+        os.environ.setdefault("SESSION_DB_PATH", os.path.join(data_dir, "sessions.sqlite3"))
+        os.environ.setdefault("LEADERBOARD_DB_PATH", os.path.join(data_dir, "leaderboard.sqlite3"))
+        os.environ.setdefault("JOURNAL_DIR", os.path.join(data_dir, "journal"))
+        os.environ.setdefault("METRICS_DIR", os.path.join(data_dir, "metrics"))
+        os.environ.setdefault("PROFILE_DIR", os.path.join(data_dir, "profile"))
+        os.environ.setdefault("TILES_PATH", os.path.join(data_dir, "tiles.mbtiles"))
+        os.environ.setdefault("ROUTES_DIR", os.path.join(data_dir, "routes"))
+        from app import app
+        self.app = app
+        self.name = "test-client"
+
+    def client(self):
+        return TestClientSession(self.app.test_client())
+
+
+class TestClientSession:
+    # The session cookie is marked Secure, so requests must look like HTTPS
+    base_url = "https://localhost"
+
+    def __init__(self, client):
+        self._client = client
+
+    def request(self, method, path, json_body=None, form=None, query=None):
+        response = self._client.open(path, method=method, json=json_body, data=form,
+                                     query_string=query, base_url=self.base_url)
+        body = response.get_json(silent=True) if response.is_json else None
+        return response.status_code, body
+
+
+class LocalCookiePolicy(http.cookiejar.DefaultCookiePolicy):
+    """Send Secure cookies over plain HTTP so a local server can be tested without TLS"""
+
+    def return_ok_secure(self, cookie, request):
+        return True
+
+
+class NoRedirects(urllib.request.HTTPRedirectHandler):
+    """Report redirects instead of following them, like the test client does"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpTarget:
+    """Drives a running server over HTTP"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.name = self.url
+
+    def client(self):
+        return HttpSession(self.url)
+
+
+class HttpSession:
+    timeout = 30
+
+    def __init__(self, url):
+        self.url = url
+        jar = http.cookiejar.CookieJar(policy=LocalCookiePolicy())
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(jar), NoRedirects())
+
+    def request(self, method, path, json_body=None, form=None, query=None):
+        url = self.url + path
+        if query:
+            url += "?" + urllib.parse.urlencode(query)
+        headers = {}
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        req = urllib.request.Request(url, data=data, headers=headers, method=method)
+        try:
+            with self._opener.open(req, timeout=self.timeout) as response:
+                status, raw, content_type = response.status, response.read(), response.headers
+        except urllib.error.HTTPError as e:
+            status, raw, content_type = e.code, e.read(), e.headers
+
+        body = None
+        if content_type.get_content_type() == "application/json":
+            body = json.loads(raw)
+        return status, body
+
+
+class Recorder:
+    """Collects (route, latency, status) samples from one worker thread"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, client, route, method, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, body = client.request(method, route, **kwargs)
+        except Exception:
+            self.errors[route] += 1
+            return None, None
+        self.samples[route].append(time.perf_counter() - start)
+        if status >= 500:
+            self.errors[route] += 1
+        return status, body
+
+
+def play_game(client, recorder, rng, bursts, player_name):
+    """Play one game from the start page to /complete_game"""
+    from game_content import CITIES
+    from game_mechanics import CHARACTERS
+
+    recorder.call(client, "/", "POST", form={
+        "start_location": rng.choice(list(CITIES)),
+        "character": rng.choice(list(CHARACTERS)),
+        "player_name": player_name
+    })
+
+    # The /move view is sent as deltas against the last acknowledged version
+    view, version = {}, None
+    for _ in range(bursts):
+        steps = rng.randint(1, 10)
+        status, body = recorder.call(client, "/move", "POST", json_body={
+            "directions": [rng.choice("wasd") for _ in range(steps)],
+            "version": version
+        })
+        if status != 200 or not body:
+            break
+        if body.get("game_over"):
+            break
+        if body.get("full"):
+            view = {}
+        view.update(body)
+        version = body.get("version")
+
+        lat, lon = view.get("position", (0, 0))
+        recorder.call(client, "/check_location", "GET", query={"lat": lat, "lon": lon})
+
+        city = view.get("current_city")
+        if view.get("current_riddle") and city in CITIES:
+            if rng.random() < CORRECT_ANSWER_RATE:
+                answer = CITIES[city].riddle_answer
+            else:
+                answer = "not " + CITIES[city].riddle_answer
+            recorder.call(client, "/solve_riddle", "POST", json_body={"answer": answer})
+
+        # Most of these hit "No active event", which is still a full request cycle
+        recorder.call(client, "/handle_event", "POST", json_body={"choice": "Continue"})
+
+    recorder.call(client, "/complete_game", "POST")
+
+
+def run_load(target, players, duration, bursts, seed):
+    """Run `players` concurrent simulated players for `duration` seconds"""
+    recorders = [Recorder() for _ in range(players)]
+    games = [0] * players
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        while time.perf_counter() < deadline:
+            play_game(target.client(), recorders[index], rng, bursts,
+                      f"load-{index}-{games[index]}")
+            games[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(players)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    samples, errors = defaultdict(list), defaultdict(int)
+    for recorder in recorders:
+        for route, latencies in recorder.samples.items():
+            samples[route].extend(latencies)
+        for route, count in recorder.errors.items():
+            errors[route] += count
+    return summarise(samples, errors, elapsed, sum(games))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarise(samples, errors, elapsed, games):
+    routes = {}
+    total = 0
+    for route in ROUTES:
+        latencies = sorted(samples.get(route, []))
+        total += len(latencies)
+        stats = {
+            "count": len(latencies),
+            "errors": errors.get(route, 0),
+            "rps": round(len(latencies) / elapsed, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0
+        }
+        for pct in PERCENTILES:
+            stats[f"p{pct}_ms"] = round(percentile(latencies, pct) * 1000, 3)
+        routes[route] = stats
+    return {
+        "elapsed": round(elapsed, 2),
+        "games": games,
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 2),
+        "routes": routes
+    }
+
+
+def bench_nearest_city(calls=20000, seed=0):
+    """Microseconds per get_nearest_city() call over random points in Europe"""
+    import game_actions
+    rng = random.Random(seed)
+    points = [(rng.uniform(42.0, 55.0), rng.uniform(-5.0, 15.0)) for _ in range(1000)]
+    start = time.perf_counter()
+    for i in range(calls):
+        game_actions.get_nearest_city(*points[i % len(points)])
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def bench_triggers(players=10000, calls=20, seed=0):
+    """Microseconds per player for one batched trigger evaluation of `players` positions"""
+    import game_actions
+    rng = random.Random(seed)
+    lat = [rng.uniform(42.0, 55.0) for _ in range(players)]
+    lon = [rng.uniform(-5.0, 15.0) for _ in range(players)]
+    table = game_actions.city_triggers()
+    start = time.perf_counter()
+    for _ in range(calls):
+        table.evaluate(lat, lon, exact_nearest=False)
+    return (time.perf_counter() - start) / (calls * players) * 1e6
+
+
+def bench_move(calls=2000, steps=10, seed=0):
+    """Microseconds per move() call with a batch of `steps` WASD steps"""
+    import game_actions
+    from game_content import CITIES
+    rng = random.Random(seed)
+    random.seed(seed)
+    directions = [[rng.choice("wasd") for _ in range(steps)] for _ in range(100)]
+
+    def new_session():
+        game_state = game_actions.new_game_state()
+        game_state.update(player_position=list(CITIES["Paris"].coordinates),
+                          character="horse_rider", current_city="Paris")
+        return {"game_state": game_state}
+
+    session = new_session()
+    elapsed = 0.0
+    for i in range(calls):
+        # Restart regularly so the random walk stays near the cities
+        if (i and i % 50 == 0) or session["game_state"]["has_died"]:
+            session = new_session()
+        payload = {"directions": directions[i % len(directions)],
+                   "version": session.get("move_view_version")}
+        start = time.perf_counter()
+        game_actions.move(session, payload)
+        elapsed += time.perf_counter() - start
+    return elapsed / calls * 1e6
+
+
+BENCHMARKS = {
+    "get_nearest_city": bench_nearest_city,
+    "triggers_per_player": bench_triggers,
+    "move": bench_move
+}
+
+
+def run_benchmarks(repeat=3):
+    """Best of `repeat` runs of each micro-benchmark, in microseconds per call"""
+    return {name: {"us_per_call": round(min(bench() for _ in range(repeat)), 3)}
+            for name, bench in BENCHMARKS.items()}
+
+
+def compare(baseline, current, tolerance):
+    """Return a list of human-readable regressions of `current` against `baseline`"""
+    regressions = []
+
+    def check(label, old, new, higher_is_worse=True):
+        if not old:
+            return
+        change = (new - old) / old
+        if (change if higher_is_worse else -change) > tolerance:
+            regressions.append(f"{label}: {old} -> {new} ({change:+.0%})")
+
+    old_load, new_load = baseline.get("load"), current.get("load")
+    if old_load and new_load:
+        check("throughput_rps", old_load["throughput_rps"], new_load["throughput_rps"],
+              higher_is_worse=False)
+    for route, old in (old_load or {}).get("routes", {}).items():
+        new = (new_load or {}).get("routes", {}).get(route)
+        if not new:
+            continue
+        for pct in PERCENTILES:
+            check(f"{route} p{pct}_ms", old[f"p{pct}_ms"], new[f"p{pct}_ms"])
+        if new["errors"] > old["errors"]:
+            regressions.append(f"{route} errors: {old['errors']} -> {new['errors']}")
+    for name, old in baseline.get("benchmarks", {}).items():
+        new = current.get("benchmarks", {}).get(name)
+        if new:
+            check(f"{name} us_per_call", old["us_per_call"], new["us_per_call"])
+    return regressions
+
+
+def print_report(results):
+    load = results.get("load")
+    if load:
+        print(f"Target: {results['target']}  players: {results['players']}  "
+              f"games: {load['games']}  requests: {load['requests']}  "
+              f"throughput: {load['throughput_rps']} req/s")
+        print(f"{'route':<16}{'count':>8}{'errors':>8}{'req/s':>10}"
+              f"{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for route, stats in load["routes"].items():
+            print(f"{route:<16}{stats['count']:>8}{stats['errors']:>8}{stats['rps']:>10}"
+                  f"{stats['mean_ms']:>10}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+                  f"{stats['p99_ms']:>10}")
+    for name, stats in results.get("benchmarks", {}).items():
+        print(f"benchmark {name}: {stats['us_per_call']} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Base URL of a running server (default: Flask test client)")
+    parser.add_argument("--players", type=int, default=10, help="Concurrent simulated players")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to generate load for")
+    parser.add_argument("--bursts", type=int, default=20, help="Move bursts per game")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-load", action="store_true", help="Only run the micro-benchmarks")
+    parser.add_argument("--no-bench", action="store_true", help="Skip the micro-benchmarks")
+    parser.add_argument("--save", metavar="PATH", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="Compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative slowdown before a comparison fails")
+    args = parser.parse_args()
+
+    target = HttpTarget(args.url) if args.url else TestClientTarget()
+    results = {
+        "target": target.name,
+        "players": args.players,
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version()
+    }
+    if not args.no_load:
+        results["load"] = run_load(target, args.players, args.duration, args.bursts, args.seed)
+    if not args.no_bench:
+        results["benchmarks"] = run_benchmarks()
+    print_report(results)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
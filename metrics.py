@@ -0,0 +1,330 @@
+"""In-process metrics with a Prometheus text endpoint and no external service.
+
+Counters and histograms are recorded into per-thread shards, so the hot
+path is a dict update with no lock. Each process periodically writes its
+merged totals to its own file in METRICS_DIR; /metrics adds up the files
+of every worker so the numbers cover the whole server. A running worker
+takes over the files of exited ones, adding their totals to its own, so
+the directory holds about one file per live process.
+
+Metric definitions live here so every module records into the same names:
+
+    from metrics import DEATHS
+    DEATHS.inc(character_key)
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Seconds between writes of this process's totals to the metrics directory
+FLUSH_INTERVAL = 5.0
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, registry: "Registry", name: str, help_text: str, labels: Sequence[str]):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        shard = self.registry.shard()
+        key = (self.name, label_values)
+        shard[key] = shard.get(key, 0) + amount
+
+    def thread_value(self, *label_values) -> float:
+        """This thread's running total, e.g. to count the calls made during one request"""
+        return self.registry.shard().get((self.name, label_values), 0)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labels, buckets):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values):
+        shard = self.registry.shard()
+        key = (self.name, label_values)
+        # Per-bucket counts (the last one is +Inf), then the sum, then the count
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(self.buckets) + 3)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+
+def _merge(into: Dict, snapshot: Dict):
+    for name, series in snapshot.items():
+        target = into.setdefault(name, {})
+        for labels, value in series.items():
+            if isinstance(value, list):
+                current = target.get(labels)
+                target[labels] = value[:] if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                target[labels] = target.get(labels, 0) + value
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self._shards: List[Dict] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.directory: Optional[str] = None
+        self._started = None
+        # Totals taken over from exited processes
+        self._absorbed: Dict = {}
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        metric = self.metrics[name] = Counter(self, name, help_text, labels)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = self.metrics[name] = Histogram(self, name, help_text, labels, buckets)
+        return metric
+
+    def shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def snapshot(self) -> Dict:
+        """This process's totals: {metric name: {label values: value}}"""
+        totals = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # Copying a dict is atomic under the GIL, so writers never need the lock
+            for (name, labels), value in shard.copy().items():
+                _merge(totals, {name: {labels: value}})
+        with self._lock:
+            _merge(totals, self._absorbed)
+        return totals
+
+    # Sharing between worker processes
+
+    def start(self, directory: str, interval: float = FLUSH_INTERVAL):
+        """Write this process's totals to `directory` every `interval` seconds"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._started = time.time_ns()
+        thread = threading.Thread(target=self._flush_loop, args=(interval,),
+                                  name="metrics-writer", daemon=True)
+        thread.start()
+        atexit.register(self.dump)
+
+    def _path(self) -> str:
+        # Unique per process, even if the pid is reused later
+        return os.path.join(self.directory, f"{os.getpid()}-{self._started}.json")
+
+    def _flush_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.dump()
+                self.absorb_exited()
+            except OSError:
+                pass
+
+    def absorb_exited(self):
+        """Take over the files of processes that have exited, so they stop piling up"""
+        # Probing a pid with signal 0 is only harmless on POSIX
+        if self.directory is None or os.name != "posix":
+            return
+        own = os.path.basename(self._path())
+        for filename in os.listdir(self.directory):
+            if filename == own or not filename.endswith((".json", ".tmp")):
+                continue
+            try:
+                pid = int(filename.split("-", 1)[0])
+            except ValueError:
+                continue
+            if _is_running(pid):
+                continue
+            path = os.path.join(self.directory, filename)
+            if filename.endswith(".tmp"):
+                # Left by a process that died while writing
+                os.remove(path)
+                continue
+            # Renaming is atomic, so only one live process takes each file
+            claimed = f"{path}.{os.getpid()}.claimed"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                with open(claimed) as f:
+                    data = json.load(f)
+            except ValueError:
+                data = []
+            with self._lock:
+                _merge(self._absorbed, {name: {tuple(labels): value for labels, value in series}
+                                        for name, series in data})
+            self.dump()
+            os.remove(claimed)
+
+    def dump(self):
+        if self.directory is None:
+            return
+        data = [[name, [[list(labels), value] for labels, value in series.items()]]
+                for name, series in self.snapshot().items()]
+        path = self._path()
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    def collect(self) -> Dict:
+        """Totals across every process that has written to the metrics directory"""
+        totals = self.snapshot()
+        if self.directory is None:
+            return totals
+        own = os.path.basename(self._path())
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json") or filename == own:
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            _merge(totals, {name: {tuple(labels): value for labels, value in series}
+                            for name, series in data})
+        return totals
+
+    def render(self, totals: Optional[Dict] = None) -> str:
+        """Prometheus text exposition format"""
+        totals = self.collect() if totals is None else totals
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(totals.get(name, {}).items()):
+                if metric.kind == "counter":
+                    lines.append(f"{name}{_format_labels(metric.labels, labels)} {_format_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), value):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _format_number(bound)
+                    lines.append(f"{name}_bucket{_format_labels(metric.labels, labels, ('le', le))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(metric.labels, labels)} {_format_number(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(metric.labels, labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Requests
+REQUESTS = REGISTRY.counter("game_requests_total", "Requests handled", ("method", "route", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("game_request_seconds", "Time spent handling a request", ("route",))
+GEODESICS_PER_REQUEST = REGISTRY.histogram(
+    "game_geodesic_calls_per_request", "Exact geodesic distance calculations per request",
+    ("route",), COUNT_BUCKETS)
+
+# Hot paths
+GEODESIC_CALLS = REGISTRY.counter("game_geodesic_calls_total", "Exact geodesic distance calculations")
+NEAREST_CITY_SECONDS = REGISTRY.histogram(
+    "game_nearest_city_seconds", "Time spent finding the nearest city and its triggers",
+    buckets=FAST_BUCKETS)
+SESSION_ENCODE_SECONDS = REGISTRY.histogram(
+    "game_session_encode_seconds", "Time spent serialising a session for the store",
+    buckets=FAST_BUCKETS)
+SESSION_ENCODE_BYTES = REGISTRY.histogram(
+    "game_session_encode_bytes", "Size of a serialised session", buckets=SIZE_BUCKETS)
+
+# Game
+DEATHS = REGISTRY.counter("game_deaths_total", "Players killed by their character's deadly event",
+                          ("character",))
+RIDDLES_SOLVED = REGISTRY.counter("game_riddles_solved_total", "Riddles solved", ("city",))
+WRONG_ANSWERS = REGISTRY.counter("game_wrong_answers_total", "Wrong riddle answers", ("city",))
+COMPLETIONS = REGISTRY.counter("game_completions_total", "Games completed", ("character",))
+ACHIEVEMENTS_UNLOCKED = REGISTRY.counter("game_achievements_total", "Achievements unlocked",
+                                        ("achievement",))
+
+
+def request_started() -> Tuple[float, float]:
+    """Mark the start of a request on this thread"""
+    return time.perf_counter(), GEODESIC_CALLS.thread_value()
+
+
+def request_finished(started: Tuple[float, float], method: str, route: str, status: int):
+    """Record a request begun with request_started() on the same thread"""
+    start, geodesics = started
+    REQUESTS.inc(method, route, str(status))
+    REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+    GEODESICS_PER_REQUEST.observe(GEODESIC_CALLS.thread_value() - geodesics, route)
+
+
+def init_metrics(app):
+    """Time every Flask request and serve the merged totals at /metrics"""
+    from flask import Response, abort, g, request
+
+    from game_logging import tokens_match
+
+    REGISTRY.start(app.config["METRICS_DIR"])
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = request_started()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            request_finished(started, request.method, route, response.status_code)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        token = app.config.get("METRICS_TOKEN")
+        if token and not tokens_match(request.headers.get("Authorization"), f"Bearer {token}"):
+            abort(403)
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,260 @@
+"""Sampling profiler for a chosen share of live requests.
+
+Profiling is switched on at runtime, for a fraction of requests or for
+particular session ids, through /debug/profile. While a selected request
+runs, a background thread samples its call stack every INTERVAL seconds
+(via sys._current_frames(), so the request itself runs unmodified). The
+samples are folded into "frame;frame;frame count" lines, the input format
+of flamegraph.pl, speedscope and most other flame graph tools.
+
+The settings live in a file shared by every worker, and each worker
+leaves its samples next to it, so one call configures and reads the whole
+server. When profiling is off, a request costs a clock read and a
+comparison.
+"""
+import atexit
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+# Seconds between stack samples of a profiled request
+INTERVAL = 0.001
+
+# Seconds a worker trusts its copy of the shared settings
+CONFIG_TTL = 1.0
+
+# Seconds between writes of a worker's samples
+DUMP_INTERVAL = 2.0
+
+# Deepest stack kept per sample; deeper frames are cut from the root end
+MAX_DEPTH = 128
+
+
+def _frame_label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def fold_stack(frame, max_depth: int = MAX_DEPTH) -> str:
+    """A frame's call stack, outermost first, as a flame graph line"""
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    def __init__(self, directory: str, interval: float = INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.config_path = os.path.join(directory, "config.json")
+        self.rate = 0.0
+        self.sids = frozenset()
+        # Off until a request could be selected; checked before anything else
+        self.enabled = False
+        self._generation = 0
+        self._config_mtime = None
+        self._checked = 0.0
+
+        self._active: Dict[int, str] = {}
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler = None
+        self._started = time.time_ns()
+        self._dirty = False
+        os.makedirs(directory, exist_ok=True)
+        self._refresh(force=True)
+
+    # Settings shared by every worker
+
+    def configure(self, rate: Optional[float] = None, sids: Optional[Iterable[str]] = None,
+                  reset: bool = False) -> Dict:
+        """Change the sampling settings for every worker and return them"""
+        config = self._read_config()
+        if rate is not None:
+            config["rate"] = min(1.0, max(0.0, float(rate)))
+        if sids is not None:
+            config["sids"] = sorted(set(sids))
+        if reset:
+            config["generation"] = config.get("generation", 0) + 1
+            for filename in os.listdir(self.directory):
+                if filename.startswith("samples-"):
+                    os.remove(os.path.join(self.directory, filename))
+        tmp = self.config_path + f".{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(config, f)
+        os.replace(tmp, self.config_path)
+        self._refresh(force=True)
+        return config
+
+    def _read_config(self) -> Dict:
+        try:
+            with open(self.config_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"rate": 0.0, "sids": [], "generation": 0}
+
+    def _refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked < CONFIG_TTL:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if not force and mtime == self._config_mtime:
+            return
+        self._config_mtime = mtime
+        config = self._read_config()
+        self.rate = config.get("rate", 0.0)
+        self.sids = frozenset(config.get("sids", ()))
+        if config.get("generation", 0) != self._generation:
+            self._generation = config.get("generation", 0)
+            with self._lock:
+                self._counts.clear()
+        self.enabled = bool(self.rate or self.sids)
+
+    def should_profile(self, sid: Optional[str] = None) -> bool:
+        """Decide whether to profile the request that is starting"""
+        self._refresh()
+        if not self.enabled:
+            return False
+        return (sid is not None and sid in self.sids) or random.random() < self.rate
+
+    # Sampling
+
+    def begin(self, label: str) -> int:
+        """Start sampling the current thread; label becomes the root frame of its stacks"""
+        thread_id = threading.get_ident()
+        self._active[thread_id] = label
+        if self._sampler is None or not self._sampler.is_alive():
+            with self._lock:
+                if self._sampler is None or not self._sampler.is_alive():
+                    self._sampler = threading.Thread(target=self._sample_loop,
+                                                     name="profiler-sampler", daemon=True)
+                    self._sampler.start()
+                    atexit.register(self.dump)
+        self._wake.set()
+        return thread_id
+
+    def end(self, thread_id: int):
+        self._active.pop(thread_id, None)
+
+    @contextmanager
+    def request(self, label: str, sid: Optional[str] = None):
+        """Profile the block if this request is selected, e.g. for the ASGI and channel actions"""
+        thread_id = self.begin(label) if self.should_profile(sid) else None
+        try:
+            yield
+        finally:
+            if thread_id is not None:
+                self.end(thread_id)
+
+    def _sample_loop(self):
+        sampler_id = threading.get_ident()
+        last_dump = time.monotonic()
+        while True:
+            if not self._active:
+                self._wake.clear()
+                # Write the last samples once the burst of profiled requests is over
+                if not self._active and not self._wake.wait(DUMP_INTERVAL if self._dirty else None):
+                    self.dump()
+                continue
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, label in list(self._active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None and thread_id != sampler_id:
+                    stacks.append(f"{label};{fold_stack(frame)}")
+            del frames
+            with self._lock:
+                self._counts.update(stacks)
+                self._dirty = True
+            if time.monotonic() - last_dump > DUMP_INTERVAL:
+                self.dump()
+                last_dump = time.monotonic()
+            time.sleep(self.interval)
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"samples-{os.getpid()}-{self._started}.json")
+
+    def dump(self):
+        """Write this worker's samples for the others to read"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"generation": self._generation, "counts": dict(self._counts)}
+            self._dirty = False
+        tmp = self._path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self._path())
+
+    def folded(self, prefix: Optional[str] = None) -> str:
+        """Samples of every worker in folded-stack format, optionally for one root label"""
+        with self._lock:
+            totals = Counter(self._counts)
+        own = os.path.basename(self._path())
+        for filename in os.listdir(self.directory):
+            if not filename.startswith("samples-") or not filename.endswith(".json") or filename == own:
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data.get("generation") == self._generation:
+                totals.update(data["counts"])
+        lines = [f"{stack} {count}" for stack, count in totals.most_common()
+                 if prefix is None or stack.startswith(prefix + ";")]
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def init_profiler(app):
+    """Sample selected Flask requests and add the /debug/profile admin endpoint"""
+    from flask import Response, abort, g, jsonify, request, session
+
+    from game_logging import tokens_match
+
+    profiler = SamplingProfiler(app.config["PROFILE_DIR"])
+    app.extensions["profiler"] = profiler
+
+    @app.before_request
+    def start_profiling():
+        if profiler.should_profile(getattr(session, "sid", None)):
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            g.profile_thread = profiler.begin(f"{request.method} {route}")
+
+    @app.teardown_request
+    def stop_profiling(exc):
+        thread_id = g.pop("profile_thread", None)
+        if thread_id is not None:
+            profiler.end(thread_id)
+
+    def authorised():
+        token = app.config.get("DEBUG_STATE_TOKEN")
+        return bool(token) and tokens_match(request.headers.get("Authorization"), f"Bearer {token}")
+
+    @app.route("/debug/profile", methods=["GET", "POST"])
+    def profile():
+        """GET: folded stacks (?route=POST /move to filter). POST: {rate, sids, reset}"""
+        if not authorised():
+            abort(403)
+        if request.method == "GET":
+            return Response(profiler.folded(request.args.get("route")), mimetype="text/plain")
+        data = request.get_json(silent=True) or {}
+        try:
+            config = profiler.configure(data.get("rate"), data.get("sids"), bool(data.get("reset")))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "Invalid settings"}), 400
+        return jsonify({"success": True, **config})
+
+    return profiler
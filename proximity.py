@@ -0,0 +1,175 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+from metrics import GEODESIC_CALLS
+
+# Mean Earth radius used by the spherical approximation (in kilometers)
+EARTH_RADIUS_KM = 6371.0088
+
+# Worst-case relative difference between the haversine distance and the
+# WGS-84 geodesic distance (the true figure is ~0.56%, rounded up for safety)
+SPHERE_ERROR = 0.006
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points on the mean-radius sphere"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = (math.sin(d_phi / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def geodesic_km(point: Tuple[float, float], target: Tuple[float, float]) -> float:
+    """Exact WGS-84 distance; geopy is only imported the first time it's needed"""
+    from geopy.distance import geodesic
+    GEODESIC_CALLS.inc()
+    return geodesic(point, target).kilometers
+
+
+def near_boundary(distance_km: float, boundary_km: float) -> bool:
+    """True when a haversine distance is too close to a boundary to trust"""
+    return abs(distance_km - boundary_km) <= boundary_km * SPHERE_ERROR / (1 - SPHERE_ERROR) + 1e-9
+
+
+def is_within(point: Tuple[float, float], target: Tuple[float, float],
+              radius_km: float, inclusive: bool = False) -> bool:
+    """Check whether point lies within radius_km of target.
+
+    Uses the cheap haversine distance and only pays for an exact geodesic
+    when the answer could differ from it.
+    """
+    distance = haversine_km(point[0], point[1], target[0], target[1])
+    if near_boundary(distance, radius_km):
+        distance = geodesic_km(point, target)
+    return distance <= radius_km if inclusive else distance < radius_km
+
+
+def _unit_vector(lat: float, lon: float) -> Tuple[float, float, float]:
+    phi = math.radians(lat)
+    lam = math.radians(lon)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+
+def _chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def _km_to_chord(distance_km: float) -> float:
+    angle = min(math.pi, distance_km / EARTH_RADIUS_KM)
+    return 2 * math.sin(angle / 2)
+
+
+class ProximityIndex:
+    """Nearest-neighbour index over named points of interest.
+
+    Points are stored as unit vectors in a 3-d KD-tree, where straight-line
+    (chord) distance orders points exactly like great-circle distance. Only
+    results that sit close to a decision boundary, or that tie within the
+    sphere/ellipsoid error, are confirmed with geopy's geodesic.
+    """
+
+    def __init__(self, points: Dict[str, Tuple[float, float]]):
+        self.names: List[str] = list(points)
+        self.coordinates: List[Tuple[float, float]] = [tuple(points[n]) for n in self.names]
+        self.vectors = [_unit_vector(lat, lon) for lat, lon in self.coordinates]
+        self._root = self._build(list(range(len(self.names))), 0)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _build(self, indices, depth):
+        if not indices:
+            return None
+        axis = depth % 3
+        indices.sort(key=lambda i: self.vectors[i][axis])
+        mid = len(indices) // 2
+        return (indices[mid], axis,
+                self._build(indices[:mid], depth + 1),
+                self._build(indices[mid + 1:], depth + 1))
+
+    def _nearest_chord(self, vector):
+        best_index = None
+        best_sq = float("inf")
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            index, axis, left, right = node
+            point = self.vectors[index]
+            sq = ((point[0] - vector[0]) ** 2 + (point[1] - vector[1]) ** 2 +
+                  (point[2] - vector[2]) ** 2)
+            if sq < best_sq:
+                best_sq = sq
+                best_index = index
+            diff = vector[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            # Visit the far side only if the splitting plane is closer than the best
+            if diff * diff < best_sq:
+                stack.append(far)
+            stack.append(near)
+        return best_index, math.sqrt(best_sq)
+
+    def _within_chord(self, vector, chord):
+        found = []
+        limit_sq = chord * chord
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            index, axis, left, right = node
+            point = self.vectors[index]
+            sq = ((point[0] - vector[0]) ** 2 + (point[1] - vector[1]) ** 2 +
+                  (point[2] - vector[2]) ** 2)
+            if sq <= limit_sq:
+                found.append(index)
+            diff = vector[axis] - point[axis]
+            if diff <= chord:
+                stack.append(left)
+            if diff >= -chord:
+                stack.append(right)
+        return found
+
+    def nearest(self, lat: float, lon: float,
+                boundary_km: Optional[float] = None) -> Tuple[Optional[str], float]:
+        """Return the nearest point's name and its distance in kilometers.
+
+        If boundary_km is given, a distance close enough to it to flip a
+        "distance < boundary_km" decision is replaced with the exact geodesic.
+        """
+        if self._root is None:
+            return None, float("inf")
+
+        vector = _unit_vector(lat, lon)
+        best_index, best_chord = self._nearest_chord(vector)
+        best_distance = _chord_to_km(best_chord)
+
+        # Any point that could be the geodesic nearest lies within the error band
+        band = best_distance * (1 + SPHERE_ERROR) / (1 - SPHERE_ERROR) + 1e-9
+        candidates = self._within_chord(vector, _km_to_chord(band))
+        if len(candidates) > 1:
+            exact = [(geodesic_km((lat, lon), self.coordinates[i]), i) for i in candidates]
+            best_distance, best_index = min(exact)
+        elif boundary_km is not None and near_boundary(best_distance, boundary_km):
+            best_distance = geodesic_km((lat, lon), self.coordinates[best_index])
+
+        return self.names[best_index], best_distance
+
+    def within(self, lat: float, lon: float, radius_km: float) -> List[Tuple[str, float]]:
+        """Return (name, distance) for every point closer than radius_km, nearest first"""
+        if self._root is None:
+            return []
+
+        vector = _unit_vector(lat, lon)
+        chord = _km_to_chord(radius_km / (1 - SPHERE_ERROR))
+        results = []
+        for index in self._within_chord(vector, chord):
+            if is_within((lat, lon), self.coordinates[index], radius_km):
+                results.append((self.names[index],
+                                haversine_km(lat, lon, *self.coordinates[index])))
+        return sorted(results, key=lambda item: item[1])
@@ -0,0 +1,415 @@
+"""Real-time game channel: actions are uploaded with fetch and results pushed back over SSE.
+
+The server runs next to the WSGI app and shares its server-side session
+store, so a player can switch between the channel and the plain HTTP
+routes at any time:
+
+    SESSION_BACKEND=sqlite FLASK_SECRET_KEY=... python realtime.py --port 8001
+
+Protocol:
+    GET  /events   opens an event stream; the first event is "hello" with a channel id
+    POST /send     {"channel", "id", "type", "payload"} runs a game action; the result
+                   arrives on the channel's stream as {"id", "type", "status", "data"}
+
+Movement can also be left to the server: an "intent" message with the
+held keys ({"keys": ["w"]}, empty to stop) hands the player to the tick
+engine, which moves them every tick and pushes "state" events shaped like
+/move responses while they move or when something happens.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import weakref
+from collections import defaultdict
+from http.cookies import CookieError, SimpleCookie
+
+import game_actions
+from content_pack import CONTENT
+from app import GAME_ACTIONS, JOURNAL, PROFILER, app as flask_app
+from metrics import request_finished, request_started
+from session_store import ServerSideSessionInterface
+from tick_engine import TICK_INTERVAL, TickEngine
+
+logger = logging.getLogger(__name__)
+
+# Seconds between keep-alive comments on idle event streams
+HEARTBEAT_INTERVAL = 25
+
+# Close keep-alive upload connections that stay silent this long
+IDLE_TIMEOUT = 75
+
+# Give up on a client that can't take a pushed event within this many seconds
+SEND_TIMEOUT = 10
+
+# Push a moving player's state every this many ticks; events are pushed straight away
+SYNC_TICKS = 3
+
+# Write a moving player's state back to the session store every this many ticks
+SAVE_TICKS = 20
+
+MAX_BODY_SIZE = 64 * 1024
+
+# Drop event streams whose unsent data grows past this many bytes
+MAX_WRITE_BUFFER = 256 * 1024
+MAX_HEADERS = 100
+
+STATUS_TEXT = {200: "OK", 204: "No Content", 400: "Bad Request", 401: "Unauthorized",
+               404: "Not Found", 409: "Conflict", 411: "Length Required",
+               413: "Payload Too Large"}
+
+
+class Channel:
+    """One open event stream"""
+
+    __slots__ = ("id", "sid", "writer", "__weakref__")
+
+    def __init__(self, sid, writer):
+        self.id = secrets.token_urlsafe(16)
+        self.sid = sid
+        self.writer = writer
+
+
+async def read_request(reader):
+    """Read one HTTP/1.1 request, returning None when the client has gone away"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+    headers = {}
+    for _ in range(MAX_HEADERS):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise ValueError("Too many headers")
+
+    body = b""
+    if "transfer-encoding" in headers:
+        raise ValueError("Chunked uploads are not supported")
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_SIZE:
+        raise ValueError("Request body too large")
+    if length:
+        body = await reader.readexactly(length)
+
+    path = target.split("?", 1)[0]
+    return method.upper(), path, headers, body
+
+
+class RealtimeServer:
+    def __init__(self, app, allowed_origins=()):
+        if not isinstance(app.session_interface, ServerSideSessionInterface):
+            raise RuntimeError("The real-time channel needs a server-side SESSION_BACKEND")
+        self.app = app
+        self.sessions = app.session_interface
+        self.lifetime = app.permanent_session_lifetime.total_seconds()
+        self.allowed_origins = set(allowed_origins)
+        self.channels = {}
+        self.player_channels = defaultdict(set)
+        # One lock per session so a player's actions are applied in order
+        self.locks = weakref.WeakValueDictionary()
+        self.engine = TickEngine()
+        self.ticks = 0
+
+    def _lock(self, sid):
+        lock = self.locks.get(sid)
+        if lock is None:
+            lock = self.locks[sid] = asyncio.Lock()
+        return lock
+
+    def _cors_headers(self, headers):
+        origin = headers.get("origin")
+        if origin and origin in self.allowed_origins:
+            return {"Access-Control-Allow-Origin": origin,
+                    "Access-Control-Allow-Credentials": "true",
+                    "Vary": "Origin"}
+        return {}
+
+    def _session_id(self, headers):
+        try:
+            cookie = SimpleCookie(headers.get("cookie", ""))
+        except CookieError:
+            return None
+        morsel = cookie.get(self.app.session_cookie_name)
+        return self.sessions.session_id(self.app, morsel.value) if morsel else None
+
+    async def _respond(self, writer, status, headers, body=b"", extra=None):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        all_headers = {"Content-Length": str(len(body)), **self._cors_headers(headers),
+                       **(extra or {})}
+        lines.extend(f"{name}: {value}" for name, value in all_headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _respond_json(self, writer, status, headers, payload):
+        await self._respond(writer, status, headers, json.dumps(payload).encode("utf-8"),
+                            {"Content-Type": "application/json"})
+
+    def _drop(self, channel):
+        self.channels.pop(channel.id, None)
+        channel.writer.close()
+
+    async def push(self, channel, event, payload):
+        """Send one event down a channel's stream, dropping the channel if it's stuck"""
+        data = json.dumps(payload, separators=(",", ":"))
+        channel.writer.write(f"event: {event}\ndata: {data}\n\n".encode("utf-8"))
+        try:
+            await asyncio.wait_for(channel.writer.drain(), SEND_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError):
+            self._drop(channel)
+
+    def push_nowait(self, sid, event, payload):
+        """Queue an event on every stream of a player without waiting for slow clients"""
+        data = json.dumps(payload, separators=(",", ":"))
+        message = f"event: {event}\ndata: {data}\n\n".encode("utf-8")
+        for channel in list(self.player_channels.get(sid, ())):
+            channel.writer.write(message)
+            if channel.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                self._drop(channel)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await asyncio.wait_for(read_request(reader), IDLE_TIMEOUT)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if method == "GET" and path == "/events":
+                    await self.stream_events(reader, writer, headers)
+                    break
+                await self.dispatch(writer, method, path, headers, body)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            await self._respond_json(writer, 400, {}, {"error": str(e)})
+        finally:
+            writer.close()
+
+    async def stream_events(self, reader, writer, headers):
+        sid = self._session_id(headers)
+        if sid is None:
+            await self._respond_json(writer, 401, headers, {"error": "Game not started"})
+            return
+
+        channel = Channel(sid, writer)
+        cors = "".join(f"{name}: {value}\r\n" for name, value in self._cors_headers(headers).items())
+        writer.write(("HTTP/1.1 200 OK\r\n"
+                      "Content-Type: text/event-stream\r\n"
+                      "Cache-Control: no-cache\r\n"
+                      "X-Accel-Buffering: no\r\n"
+                      f"{cors}\r\n").encode("latin-1"))
+        self.channels[channel.id] = channel
+        self.player_channels[sid].add(channel)
+        await self.push(channel, "hello", {"channel": channel.id,
+                                           "tick_ms": round(TICK_INTERVAL * 1000)})
+
+        # Nothing more is read from an event stream; wait for the client to hang up
+        try:
+            while await reader.read(1024):
+                pass
+        finally:
+            self.channels.pop(channel.id, None)
+            self.player_channels[sid].discard(channel)
+            if not self.player_channels[sid]:
+                del self.player_channels[sid]
+                # The last stream is gone, so the player has left
+                if sid in self.engine:
+                    await self.save_player(sid, self.engine.leave(sid))
+
+    async def dispatch(self, writer, method, path, headers, body):
+        if method == "OPTIONS":
+            await self._respond(writer, 204, headers, extra={
+                "Access-Control-Allow-Methods": "POST, GET, OPTIONS",
+                "Access-Control-Allow-Headers": "Content-Type",
+                "Access-Control-Max-Age": "600"})
+        elif method == "GET" and path == "/health":
+            await self._respond_json(writer, 200, headers, {"channels": len(self.channels)})
+        elif method == "POST" and path == "/send":
+            await self.send(writer, headers, body)
+        else:
+            await self._respond_json(writer, 404, headers, {"error": "Not found"})
+
+    async def send(self, writer, headers, body):
+        try:
+            message = json.loads(body or b"{}")
+        except ValueError:
+            await self._respond_json(writer, 400, headers, {"error": "Invalid JSON"})
+            return
+
+        channel = self.channels.get(message.get("channel"))
+        sid = self._session_id(headers)
+        if channel is None or sid is None or channel.sid != sid:
+            await self._respond_json(writer, 409, headers, {"error": "Unknown channel"})
+            return
+
+        # The channel carries the same actions as before, recorded in the journal
+        action = GAME_ACTIONS.get(message.get("type")) if message.get("type") in game_actions.ACTIONS else None
+        if action is None and message.get("type") != "intent":
+            await self._respond_json(writer, 400, headers, {"error": "Unknown message type"})
+            return
+
+        # Acknowledge the upload straight away; the result follows on the stream
+        await self._respond(writer, 204, headers)
+
+        if action is None:
+            payload, status = await self.set_intent(sid, message.get("payload") or {})
+        else:
+            async with self._lock(sid):
+                # While the tick engine moves the player its copy of their state is the current one
+                fields = self.engine.fields(sid) if sid in self.engine else None
+                loop = asyncio.get_running_loop()
+                payload, status, game_state = await loop.run_in_executor(
+                    None, self.run_action, sid, action, message.get("payload") or {}, fields)
+                if game_state is not None and sid in self.engine:
+                    self.engine.update(sid, game_state)
+
+        await self.push(channel, "result", {"id": message.get("id"), "type": message.get("type"),
+                                            "status": status, "data": payload})
+
+    def run_action(self, sid, action, payload, fields=None):
+        """Load the player's session, apply an action and store the changes (runs in a thread)"""
+        CONTENT.refresh()
+        started = request_started()
+        with PROFILER.request(f"CHANNEL {action.__name__}", sid):
+            response, status, game_state = self._run_action(sid, action, payload, fields)
+        request_finished(started, "CHANNEL", action.__name__, status)
+        return response, status, game_state
+
+    def _run_action(self, sid, action, payload, fields):
+        session = self.sessions.load(sid)
+        if session is None:
+            return {"error": "Game not started"}, 400, None
+        if fields and session.get("game_state"):
+            session["game_state"].update(fields)
+            JOURNAL.record(session["game_state"], "sync", fields)
+        try:
+            response, status = action(session, payload)
+        except Exception:
+            logger.exception("Error handling real-time message")
+            return {"error": "Internal error"}, 500, None
+        self.sessions.persist(session, self.lifetime)
+        return response, status, session.get("game_state")
+
+    async def set_intent(self, sid, payload):
+        """Update the keys a player holds, handing them to the tick engine if needed"""
+        keys = payload.get("keys")
+        if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+            return {"error": "Invalid intent"}, 400
+
+        if sid not in self.engine:
+            async with self._lock(sid):
+                loop = asyncio.get_running_loop()
+                session = await loop.run_in_executor(None, self.sessions.load, sid)
+                game_state = session.get("game_state") if session is not None else None
+                try:
+                    self.engine.join(sid, game_state or {})
+                except ValueError as e:
+                    return {"error": str(e)}, 400
+
+        self.engine.set_intent(sid, keys)
+        if not self.engine.is_moving(sid):
+            # Settle the final position now rather than at the next save
+            self.push_nowait(sid, "state", self.engine.view(sid))
+            await self.save_player(sid, self.engine.fields(sid))
+        return {"success": True, "moving": self.engine.is_moving(sid)}, 200
+
+    async def save_player(self, sid, fields):
+        """Write engine-owned fields back into the player's stored game state"""
+        async with self._lock(sid):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.store_fields, sid, fields)
+
+    def store_fields(self, sid, fields):
+        session = self.sessions.load(sid)
+        if session is None or not session.get("game_state"):
+            return
+        session["game_state"].update(fields)
+        JOURNAL.record(session["game_state"], "sync", fields)
+        self.sessions.persist(session, self.lifetime)
+
+    async def tick_loop(self):
+        """Advance the tick engine at a fixed rate and push the results"""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += TICK_INTERVAL
+            delay = next_tick - loop.time()
+            if delay < -TICK_INTERVAL:
+                # Fell behind; skip the missed ticks instead of bursting through them
+                next_tick = loop.time()
+            await asyncio.sleep(max(0.0, delay))
+
+            CONTENT.refresh()
+            events = self.engine.tick()
+            self.ticks += 1
+            sync = self.ticks % SYNC_TICKS == 0
+            save = self.ticks % SAVE_TICKS == 0
+            players = set(events)
+            if sync or save:
+                players.update(self.engine.moving_sids())
+
+            for sid in players:
+                if sync or sid in events:
+                    self.push_nowait(sid, "state", {**self.engine.view(sid), **events.get(sid, {})})
+                if save or sid in events:
+                    asyncio.create_task(self.save_player(sid, self.engine.fields(sid)))
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for channel in list(self.channels.values()):
+                channel.writer.write(b": ping\n\n")
+                if channel.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                    # The client stopped reading; don't let its buffer grow forever
+                    self._drop(channel)
+
+
+def raise_file_limit():
+    """Allow as many open connections as the OS permits"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+async def serve(host, port, allowed_origins):
+    server = RealtimeServer(flask_app, allowed_origins)
+    listener = await asyncio.start_server(server.handle_connection, host, port, backlog=1024)
+    logger.warning("Real-time channel listening on %s:%d", host, port)
+    tasks = [asyncio.create_task(server.heartbeat()), asyncio.create_task(server.tick_loop())]
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("REALTIME_PORT", 8001)))
+    args = parser.parse_args()
+
+    if "FLASK_SECRET_KEY" not in os.environ:
+        parser.error("FLASK_SECRET_KEY must be set so session cookies can be shared with the app")
+
+    allowed_origins = [origin for origin in
+                       os.environ.get("REALTIME_ALLOWED_ORIGINS", "").split(",") if origin]
+    raise_file_limit()
+    asyncio.run(serve(args.host, args.port, allowed_origins))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Minimum move counts between the game's places, for every character.
+
+A player moves on a lattice: each WASD step changes latitude or longitude
+by MOVEMENT_SPEED times the character's move_multiplier. The route table
+holds, for each step size and each pair of places (the cities, the
+mysterious location and the château), the fewest steps from the first
+place to inside the second one's trigger radius, and where on the lattice
+that step lands, so the path itself can be rebuilt. A tired player (stamina
+under 20) takes half steps, so the counts are for a rested player and are
+lower bounds.
+
+Building the table costs a few lattice points per pair of places. It is
+built (and NumPy imported) on first use, so starting a worker stays
+cheap, cached on disk under a key of the content version and the
+movement rules, and rebuilt after the content changes. Worlds with more
+than MAX_PLACES places get no table:
+
+    python routes.py build
+    python routes.py show --character knight
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from content_pack import CONTENT
+from game_actions import (
+    CHATEAU_LOCATION, CITY_ENTRY_THRESHOLD, MOVEMENT_SPEED, MYSTERIOUS_LOCATION, REVEAL_THRESHOLD
+)
+from proximity import is_within
+
+logger = logging.getLogger(__name__)
+
+# Names of the places other than cities
+MYSTERY = "mysterious_location"
+CHATEAU = "chateau"
+
+# Kilometres per degree of latitude, a little under the real value so boxes are never too small
+KM_PER_DEGREE = 110.5
+
+# Worlds with more places than this get no table: it grows with the square of their number
+MAX_PLACES = 512
+
+# Bump when the table's layout or the way it is computed changes
+TABLE_VERSION = 1
+
+
+def places_of(world) -> Dict[str, Tuple[Tuple[float, float], float]]:
+    """Every place of a world, with its position and the radius that counts as arriving"""
+    places = {name: (tuple(position), CITY_ENTRY_THRESHOLD)
+              for name, position in world.city_coordinates().items()}
+    places[MYSTERY] = (tuple(MYSTERIOUS_LOCATION), REVEAL_THRESHOLD)
+    places[CHATEAU] = (tuple(CHATEAU_LOCATION), CITY_ENTRY_THRESHOLD)
+    return places
+
+
+def step_sizes(world) -> Dict[str, float]:
+    """Each character's step in degrees"""
+    return {key: MOVEMENT_SPEED * character.move_multiplier for key, character in world.characters.items()}
+
+
+def fewest_steps(origin: Sequence[float], target: Sequence[float], radius_km: float,
+                 step: float) -> Tuple[int, int]:
+    """Lattice steps (north, east) of the nearest arrival within radius_km of target.
+
+    Only the lattice points in a box around the target's circle can be
+    arrivals; the one reached with the fewest steps wins, ties going to the
+    closest to the target.
+    """
+    import numpy as np
+    from triggers import haversine_km_array, near_boundary_array
+
+    if is_within(origin, target, radius_km):
+        return 0, 0
+    lat_margin = radius_km / KM_PER_DEGREE
+    lon_margin = lat_margin / max(0.01, np.cos(np.radians(min(abs(target[0]) + lat_margin, 89.0))))
+    north = np.arange(np.ceil((target[0] - lat_margin - origin[0]) / step),
+                      np.floor((target[0] + lat_margin - origin[0]) / step) + 1)
+    east = np.arange(np.ceil((target[1] - lon_margin - origin[1]) / step),
+                     np.floor((target[1] + lon_margin - origin[1]) / step) + 1)
+    north, east = (grid.ravel() for grid in np.meshgrid(north, east, indexing="ij"))
+    lat, lon = origin[0] + north * step, origin[1] + east * step
+    distance = haversine_km_array(np.radians(lat), np.radians(lon),
+                                  np.radians(target[0]), np.radians(target[1]))
+    steps = np.abs(north) + np.abs(east)
+    for i in np.lexsort((distance, steps)):
+        if distance[i] >= radius_km and not near_boundary_array(distance[i], radius_km):
+            continue
+        # Settle points close to the edge with the exact distance, as the triggers do
+        if is_within((lat[i], lon[i]), target, radius_km):
+            return int(north[i]), int(east[i])
+    raise ValueError(f"No lattice point within {radius_km} km of {target}")
+
+
+class RouteTable:
+    """Fewest moves and paths between places, per character"""
+
+    def __init__(self, key: str, places: List[str], steps, characters: Dict[str, int], offsets):
+        self.key = key
+        self.places = places
+        self.steps = steps
+        # Index into steps for every character
+        self.characters = characters
+        # (step size, origin, target) -> lattice steps (north, east) of the arrival
+        self.offsets = offsets
+        self.moves_table = abs(offsets).sum(axis=3)
+        self._index = {name: i for i, name in enumerate(places)}
+
+    def moves(self, character: str, origin: str, target: str) -> int:
+        """Fewest moves from origin to target"""
+        return int(self.moves_table[self.characters[character], self._index[origin], self._index[target]])
+
+    def path(self, character: str, origin: str, target: str) -> str:
+        """One shortest path as WASD keys: all the north/south steps, then east/west"""
+        north, east = self.offsets[self.characters[character], self._index[origin], self._index[target]]
+        return ("w" if north > 0 else "s") * abs(int(north)) + ("d" if east > 0 else "a") * abs(int(east))
+
+    def tour(self, character: str, stops: Sequence[str]) -> int:
+        """Fewest moves to visit the stops in order"""
+        return sum(self.moves(character, origin, target) for origin, target in zip(stops, stops[1:]))
+
+    def nearest(self, character: str, origin: str, targets: Sequence[str]) -> Optional[Tuple[str, int]]:
+        """The target fewest moves away from origin, with that count"""
+        row = self.moves_table[self.characters[character], self._index[origin]]
+        best = min(targets, key=lambda name: row[self._index[name]], default=None)
+        return (best, int(row[self._index[best]])) if best is not None else None
+
+    def save(self, path: str):
+        import numpy as np
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, offsets=self.offsets, steps=self.steps,
+                     meta=np.frombuffer(json.dumps({"key": self.key, "places": self.places,
+                                                    "characters": self.characters}).encode(), np.uint8))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "RouteTable":
+        import numpy as np
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes())
+            return cls(meta["key"], meta["places"], data["steps"], meta["characters"], data["offsets"])
+
+
+def table_key(world) -> str:
+    """Identifies the content and movement rules a table was built for"""
+    digest = hashlib.sha256(json.dumps({
+        "table": TABLE_VERSION,
+        "content": world.version,
+        "places": places_of(world),
+        "steps": step_sizes(world),
+    }, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def build_table(world) -> RouteTable:
+    """Compute the fewest moves between every pair of a world's places"""
+    import numpy as np
+    places = places_of(world)
+    names = list(places)
+    sizes = step_sizes(world)
+    steps = np.array(sorted(set(sizes.values())))
+    offsets = np.zeros((len(steps), len(names), len(names), 2), dtype=np.int32)
+    for s, step in enumerate(steps):
+        for i, origin in enumerate(names):
+            for j, target in enumerate(names):
+                if i != j:
+                    position, radius = places[target]
+                    offsets[s, i, j] = fewest_steps(places[origin][0], position, radius, step)
+    characters = {key: int(np.searchsorted(steps, size)) for key, size in sizes.items()}
+    return RouteTable(table_key(world), names, steps, characters, offsets)
+
+
+class RouteStore:
+    """The route table of the current content, loaded from or saved to a cache directory"""
+
+    def __init__(self):
+        self.directory: Optional[str] = None
+        self._table: Optional[RouteTable] = None
+        # The world the table was made for; a reload swaps in a new one
+        self._world = None
+        self._lock = threading.Lock()
+
+    def use(self, directory: Optional[str]):
+        self.directory = directory
+        self._world = None
+
+    @property
+    def table(self) -> Optional[RouteTable]:
+        """The current content's table, or None if it has too many places for one"""
+        world = CONTENT.world
+        if self._world is not world:
+            with self._lock:
+                if self._world is not world:
+                    self._table = self._load_or_build(world)
+                    self._world = world
+        return self._table
+
+    def _load_or_build(self, world) -> Optional[RouteTable]:
+        places = len(world.cities) + 2
+        if places > MAX_PLACES:
+            logger.warning("Not building a route table for %d places (at most %d)", places, MAX_PLACES)
+            return None
+        key = table_key(world)
+        path = os.path.join(self.directory, f"routes-{key}.npz") if self.directory else None
+        if path and os.path.exists(path):
+            try:
+                return RouteTable.load(path)
+            except (OSError, ValueError, KeyError):
+                logger.warning("Could not read route table %s; rebuilding it", path, exc_info=True)
+        table = build_table(world)
+        if path:
+            os.makedirs(self.directory, exist_ok=True)
+            table.save(path)
+            # Tables of earlier content are never used again
+            for filename in os.listdir(self.directory):
+                if filename.startswith("routes-") and filename.endswith(".npz") and filename != os.path.basename(path):
+                    os.remove(os.path.join(self.directory, filename))
+        return table
+
+
+ROUTES = RouteStore()
+
+
+def init_routes(app):
+    """Cache route tables in ROUTES_DIR"""
+    ROUTES.use(app.config["ROUTES_DIR"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default=os.environ.get("ROUTES_DIR", os.path.join("instance", "routes")),
+                        help="Route table cache directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="Build (or load) the table for the current content")
+    show = commands.add_parser("show", help="Print one character's fewest moves between places")
+    show.add_argument("--character", required=True)
+    args = parser.parse_args()
+
+    CONTENT.use(os.environ.get("CONTENT_PACK"))
+    ROUTES.use(args.dir)
+    table = ROUTES.table
+    if table is None:
+        parser.error(f"The content has more than {MAX_PLACES} places")
+    if args.command == "build":
+        print(json.dumps({"key": table.key, "places": len(table.places),
+                          "step_sizes": table.steps.tolist()}))
+        return
+    if args.character not in table.characters:
+        parser.error(f"Unknown character {args.character!r}")
+    width = max(len(name) for name in table.places)
+    print(" " * width + "".join(f"{name[:8]:>9}" for name in table.places))
+    for origin in table.places:
+        print(f"{origin:<{width}}" + "".join(f"{table.moves(args.character, origin, target):>9}"
+                                             for target in table.places))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from metrics import SESSION_ENCODE_BYTES, SESSION_ENCODE_SECONDS
+
+# Separator between a top-level session key and one of its sub-keys
+FIELD_SEP = "\x1f"
+
+# Only extend a session's expiry on read-only requests once this many seconds have passed
+TOUCH_INTERVAL = 60
+
+
+def flatten_session(data: Dict, serializer) -> Dict[str, str]:
+    """Split a session into separately stored fields.
+
+    Plain dict values are split one level further, so a request that
+    changes one of their keys only rewrites that field. A GameState is not
+    a dict: it is encoded whole and stored as a single field, which is
+    rewritten on any change (a few hundred bytes). A game_state saved as a
+    plain dict before GameState existed stays split until a new game starts.
+    """
+    fields = {}
+    for key, value in data.items():
+        if isinstance(value, dict) and value and all(isinstance(k, str) for k in value):
+            for sub_key, sub_value in value.items():
+                fields[f"{key}{FIELD_SEP}{sub_key}"] = serializer.dumps(sub_value)
+        else:
+            fields[key] = serializer.dumps(value)
+    return fields
+
+
+def unflatten_session(fields: Dict[str, str], serializer) -> Dict:
+    """Rebuild the session dict from its stored fields"""
+    data = {}
+    for field, raw in fields.items():
+        key, sep, sub_key = field.partition(FIELD_SEP)
+        if sep:
+            data.setdefault(key, {})[sub_key] = serializer.loads(raw)
+        else:
+            data[key] = serializer.loads(raw)
+    return data
+
+
+class MemoryStore:
+    """In-process LRU session store with per-session expiry.
+
+    Only suitable when a single worker process serves every request.
+    """
+
+    def __init__(self, max_sessions: int = 10000):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Tuple[float, Dict[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid: str) -> Optional[Tuple[Dict[str, str], float]]:
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            expires, fields = entry
+            if expires < time.time():
+                del self._sessions[sid]
+                return None
+            self._sessions.move_to_end(sid)
+            return dict(fields), expires
+
+    def save(self, sid: str, changed: Dict[str, str], removed: Iterable[str], expires: float):
+        with self._lock:
+            _, fields = self._sessions.pop(sid, (None, {}))
+            fields.update(changed)
+            for field in removed:
+                fields.pop(field, None)
+            self._sessions[sid] = (expires, fields)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def touch(self, sid: str, expires: float):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is not None:
+                self._sessions[sid] = (expires, entry[1])
+
+    def delete(self, sid: str):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class SQLiteStore:
+    """Session store shared by every worker process through one SQLite file"""
+
+    # Purge expired sessions roughly once every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    sid TEXT PRIMARY KEY,
+                    expires REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+                CREATE TABLE IF NOT EXISTS session_fields (
+                    sid TEXT NOT NULL,
+                    field TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (sid, field)
+                ) WITHOUT ROWID;
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid: str) -> Optional[Tuple[Dict[str, str], float]]:
+        conn = self._connect()
+        row = conn.execute("SELECT expires FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        if row is None:
+            return None
+        if row[0] < time.time():
+            self.delete(sid)
+            return None
+        fields = dict(conn.execute(
+            "SELECT field, value FROM session_fields WHERE sid = ?", (sid,)))
+        return fields, row[0]
+
+    def save(self, sid: str, changed: Dict[str, str], removed: Iterable[str], expires: float):
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (sid, expires) VALUES (?, ?)",
+                         (sid, expires))
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_fields (sid, field, value) VALUES (?, ?, ?)",
+                [(sid, field, value) for field, value in changed.items()])
+            conn.executemany("DELETE FROM session_fields WHERE sid = ? AND field = ?",
+                             [(sid, field) for field in removed])
+
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def touch(self, sid: str, expires: float):
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE sessions SET expires = ? WHERE sid = ?", (expires, sid))
+
+    def delete(self, sid: str):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM session_fields WHERE sid = ?", (sid,))
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def purge_expired(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM session_fields WHERE sid IN "
+                         "(SELECT sid FROM sessions WHERE expires < ?)", (time.time(),))
+            conn.execute("DELETE FROM sessions WHERE expires < ?", (time.time(),))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data lives in a store; the cookie only carries its id"""
+
+    def __init__(self, initial=None, sid=None, new=False, stored=None, expires=0.0):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # Serialised fields as last loaded from / written to the store
+        self.stored = stored or {}
+        self.expires = expires
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in a server-side store and an opaque, signed id in the cookie"""
+
+    serializer = TaggedJSONSerializer()
+    salt = "server-side-session"
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app) -> Optional[Signer]:
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt=self.salt)
+
+    def session_id(self, app, cookie: Optional[str]) -> Optional[str]:
+        """Return the session id carried by a session cookie, if its signature is valid"""
+        signer = self._signer(app)
+        if signer is None or not cookie:
+            return None
+        try:
+            return signer.unsign(cookie).decode("utf-8")
+        except BadSignature:
+            return None
+
+    def load(self, sid: str) -> Optional[ServerSideSession]:
+        """Load a stored session by id, or None if it doesn't exist or has expired"""
+        loaded = self.store.load(sid)
+        if loaded is None:
+            return None
+        fields, expires = loaded
+        return ServerSideSession(unflatten_session(fields, self.serializer),
+                                 sid=sid, stored=fields, expires=expires)
+
+    def persist(self, session: ServerSideSession, lifetime: float):
+        """Write a session's changed fields back to the store"""
+        # An emptied session is removed from the store
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+            return
+
+        expires = time.time() + lifetime
+
+        # Nested game_state updates don't always flag the session as modified,
+        # so diff the serialised fields and only write the ones that changed
+        changed, removed = {}, []
+        if session.accessed or session.modified or session.new:
+            start = time.perf_counter()
+            fields = flatten_session(session, self.serializer)
+            SESSION_ENCODE_SECONDS.observe(time.perf_counter() - start)
+            SESSION_ENCODE_BYTES.observe(sum(len(field) + len(value) for field, value in fields.items()))
+            changed = {field: value for field, value in fields.items()
+                       if session.stored.get(field) != value}
+            removed = [field for field in session.stored if field not in fields]
+
+        if changed or removed or session.new:
+            self.store.save(session.sid, changed, removed, expires)
+            session.stored = fields
+        elif expires - session.expires > TOUCH_INTERVAL:
+            self.store.touch(session.sid, expires)
+
+    def open_session(self, app, request):
+        if self._signer(app) is None:
+            return None
+
+        sid = self.session_id(app, request.cookies.get(app.session_cookie_name))
+        session = self.load(sid) if sid else None
+        if session is None:
+            session = ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+        return session
+
+    def save_session(self, app, session, response):
+        name = app.session_cookie_name
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        self.persist(session, app.permanent_session_lifetime.total_seconds())
+
+        # An emptied session also loses its cookie
+        if not session:
+            if not session.new:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.new:
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid.encode("utf-8")).decode("utf-8"),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def create_session_interface(backend: str, path: Optional[str] = None) -> SessionInterface:
+    """Build the session interface for the configured backend name"""
+    if backend == "cookie":
+        return SecureCookieSessionInterface()
+    if backend == "memory":
+        return ServerSideSessionInterface(MemoryStore())
+    if backend == "sqlite":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return ServerSideSessionInterface(SQLiteStore(path))
+    raise ValueError(f"Unknown session backend: {backend}")
@@ -0,0 +1,314 @@
+"""Monte Carlo balance simulator: many headless games per character.
+
+Simulated players play under the real rules. The tick engine
+(tick_engine.TickEngine, which follows game_actions.apply_move_step)
+moves a whole batch of them one step per tick, with the deadly events,
+stamina, city triggers and random events computed for the batch at once.
+Riddles, event choices and the end of the game go through
+game_actions.solve_riddle, handle_event and complete_game, exactly as for
+a player on the real-time channel. Players start in a random city, head
+for the nearest unsolved city (or follow a scripted --route) and then
+for the château.
+
+Batches run in parallel on a process pool. The report gives, per
+character, the share of games finished, ended by a deadly event or given
+up after --max-moves, the survival curve over moves, and the moves and
+final scores of the finished games:
+
+    python simulate.py --games 100000
+    python simulate.py --games 20000 --characters scholar noble --accuracy 0.7
+    python simulate.py --route London,Paris,Amsterdam,Berlin,Geneva --json balance.json
+"""
+import argparse
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+import game_actions
+from content_pack import CONTENT
+from game_actions import CHATEAU_LOCATION
+from game_content import CITIES
+from game_mechanics import CHARACTERS
+from journal import ReplayLeaderboard
+from tick_engine import TickEngine
+from triggers import haversine_km_array
+
+# Games simulated together in one tick engine
+BATCH_SIZE = 10000
+
+# Moves after which a simulated player gives up
+MAX_MOVES = 3000
+
+# Moves at which the survival curve is reported
+SURVIVAL_POINTS = (10, 25, 50, 100, 200, 400, 800, 1600)
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# How a simulated game ended
+FINISHED, DIED, GAVE_UP = 1, 2, 3
+
+WRONG_ANSWER = "a wrong guess"
+
+
+def simulate_batch(character: str, games: int, seed: int, route: Optional[Sequence[str]] = None,
+                   accuracy: float = 1.0, max_moves: int = MAX_MOVES) -> Dict[str, np.ndarray]:
+    """Play a batch of games of one character to the end.
+
+    accuracy is the chance that a riddle guess is right. Returns one entry
+    per game in each of the arrays "outcome", "moves", "score" (final
+    score of finished games), "riddles" and "events".
+    """
+    rng = random.Random(seed)
+    engine = TickEngine(capacity=games, seed=seed)
+    leaderboard = ReplayLeaderboard()
+    names = list(CITIES)
+    city_index = {name: i for i, name in enumerate(names)}
+    # Targets: every city, then the château
+    targets = np.array([CITIES[name].coordinates for name in names] + [CHATEAU_LOCATION])
+    route = np.array([city_index[name] for name in route or ()], dtype=np.int64)
+
+    sessions = []
+    inside = np.empty(games, dtype=np.int64)
+    for i in range(games):
+        start = rng.choice(names)
+        game_state = game_actions.new_game_state()
+        game_state.update({
+            "current_city": start,
+            "start_city": start,
+            "player_position": list(CITIES[start].coordinates),
+            "character": character,
+            "player_name": f"sim-{i}",
+            "in_city": True,
+        })
+        sessions.append({"game_state": game_state})
+        engine.join(str(i), game_state)
+        inside[i] = city_index[start]
+    slots = np.array([engine.slots[str(i)] for i in range(games)])
+
+    outcome = np.zeros(games, dtype=np.int8)
+    moves = np.zeros(games, dtype=np.int32)
+    score = np.zeros(games, dtype=np.int32)
+    riddles = np.zeros(games, dtype=np.int16)
+    events = np.zeros(games, dtype=np.int16)
+    solved = np.zeros((games, len(names)), dtype=np.bool_)
+    target = np.zeros(games, dtype=np.int64)
+    retarget = np.ones(games, dtype=np.bool_)
+    playing = np.ones(games, dtype=np.bool_)
+
+    def act(i, action, data):
+        # Hand the engine's copy of the state to the action and back, as realtime.py does
+        sid = str(i)
+        game_state = sessions[i]["game_state"]
+        game_state.update(engine.fields(sid))
+        response, _ = action(sessions[i], data)
+        engine.update(sid, game_state)
+        return response
+
+    def finish(i, how):
+        outcome[i] = how
+        moves[i] = engine.moves[slots[i]]
+        playing[i] = False
+        engine.leave(str(i))
+
+    def choose_targets(players):
+        unsolved = ~solved[players]
+        lat = np.radians(engine.lat[slots[players]])[:, None]
+        lon = np.radians(engine.lon[slots[players]])[:, None]
+        distance = haversine_km_array(lat, lon, np.radians(targets[:-1, 0]), np.radians(targets[:-1, 1]))
+        distance[~unsolved] = np.inf
+        chosen = np.argmin(distance, axis=1)
+        if len(route):
+            # The first city of the route not solved yet, then the nearest of any left out
+            pending = unsolved[:, route]
+            chosen = np.where(pending.any(axis=1), route[np.argmax(pending, axis=1)], chosen)
+        target[players] = np.where(unsolved.any(axis=1), chosen, len(names))
+        retarget[players] = False
+
+    for _ in range(max_moves):
+        players = np.flatnonzero(playing)
+        if not len(players):
+            break
+        choose_targets(players[retarget[players]])
+
+        # Step along whichever axis is further from the target
+        player_slots = slots[players]
+        lat, lon = engine.lat[player_slots], engine.lon[player_slots]
+        goal = targets[target[players]]
+        gap_lat = goal[:, 0] - lat
+        gap_lon = (goal[:, 1] - lon) * np.cos(np.radians(lat))
+        along_lat = np.abs(gap_lat) >= np.abs(gap_lon)
+        engine.dlat[player_slots] = np.where(along_lat, np.sign(gap_lat), 0)
+        engine.dlon[player_slots] = np.where(along_lat, 0, np.sign(gap_lon))
+        # A riddle is only asked on entering a city, so leave the start city to come back
+        leaving = target[players] == inside[players]
+        engine.dlat[player_slots[leaving]] = 1
+        engine.dlon[player_slots[leaving]] = 0
+
+        for sid, happened in engine.tick().items():
+            i = int(sid)
+            if happened.get("game_over"):
+                finish(i, DIED)
+                continue
+            if happened.get("left_city"):
+                inside[i] = -1
+                retarget[i] = True
+            city = happened.get("entered_city")
+            if city is not None:
+                inside[i] = city_index[city]
+                if engine.players[slots[i]]["current_riddle"]:
+                    answer = CITIES[city].riddle_answer
+                    while not act(i, game_actions.solve_riddle,
+                                  {"answer": answer if rng.random() < accuracy else WRONG_ANSWER})["success"]:
+                        pass
+                    solved[i, city_index[city]] = True
+                    riddles[i] += 1
+                    retarget[i] = True
+            if "event" in happened:
+                event = engine.players[slots[i]]["current_event"]
+                act(i, partial(game_actions.handle_event, rng=rng),
+                    {"choice": rng.choice(event["choices"])["text"]})
+                events[i] += 1
+            if happened.get("at_chateau"):
+                response = act(i, partial(game_actions.complete_game, leaderboard=leaderboard), {})
+                leaderboard.entries.clear()
+                score[i] = response["final_score"]
+                finish(i, FINISHED)
+
+        for i in np.flatnonzero(playing & (engine.moves[slots] >= max_moves)):
+            finish(i, GAVE_UP)
+
+    for i in np.flatnonzero(playing):
+        finish(i, GAVE_UP)
+    return {"character": character, "outcome": outcome, "moves": moves, "score": score,
+            "riddles": riddles, "events": events}
+
+
+def _distribution(values: np.ndarray) -> Dict:
+    if not len(values):
+        return {}
+    summary = {"mean": round(float(values.mean()), 1)}
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{percentile}"] = round(float(value), 1)
+    return summary
+
+
+def summarize(batches: List[Dict], max_moves: int = MAX_MOVES) -> Dict:
+    """Outcome shares, survival curve and distributions for one character's batches"""
+    outcome = np.concatenate([batch["outcome"] for batch in batches])
+    moves = np.concatenate([batch["moves"] for batch in batches])
+    score = np.concatenate([batch["score"] for batch in batches])
+    games = len(outcome)
+    finished = outcome == FINISHED
+    died = outcome == DIED
+    # Share of players not (yet) killed by a deadly event after so many moves
+    death_moves = np.sort(moves[died])
+    survival = {points: round(1 - np.searchsorted(death_moves, points, side="right") / games, 4)
+                for points in SURVIVAL_POINTS if points <= max_moves}
+    return {
+        "games": games,
+        "finished": round(float(finished.mean()), 4),
+        "died": round(float(died.mean()), 4),
+        "gave_up": round(float((outcome == GAVE_UP).mean()), 4),
+        "survival": survival,
+        "moves": _distribution(moves[finished]),
+        "score": _distribution(score[finished]),
+        "moves_before_death": _distribution(moves[died]),
+        "riddles_per_game": round(float(np.concatenate([batch["riddles"] for batch in batches]).mean()), 2),
+        "events_per_game": round(float(np.concatenate([batch["events"] for batch in batches]).mean()), 2),
+    }
+
+
+def simulate(characters: Sequence[str], games: int, workers: Optional[int] = None,
+             batch_size: int = BATCH_SIZE, seed: Optional[int] = None, route: Optional[Sequence[str]] = None,
+             accuracy: float = 1.0, max_moves: int = MAX_MOVES) -> Dict:
+    """Play games per character in batches across a process pool and summarise them"""
+    start = time.perf_counter()
+    seeds = random.Random(seed)
+    tasks = [(character, min(batch_size, games - done), seeds.getrandbits(32))
+             for character in characters for done in range(0, games, batch_size)]
+    run = partial(_run_task, route=route, accuracy=accuracy, max_moves=max_moves)
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+    results: Dict[str, List[Dict]] = {character: [] for character in characters}
+    if workers > 1:
+        # Workers play in the same world as this process
+        with ProcessPoolExecutor(max_workers=workers, initializer=CONTENT.use,
+                                 initargs=(CONTENT.path,)) as pool:
+            for batch in pool.map(run, tasks):
+                results[batch["character"]].append(batch)
+    else:
+        for task in tasks:
+            batch = run(task)
+            results[batch["character"]].append(batch)
+
+    elapsed = time.perf_counter() - start
+    total = games * len(characters)
+    return {
+        "games": total,
+        "seconds": round(elapsed, 2),
+        "games_per_minute": round(total / elapsed * 60) if elapsed else 0,
+        "characters": {character: summarize(batches, max_moves) for character, batches in results.items()},
+    }
+
+
+def _run_task(task, route, accuracy, max_moves):
+    character, games, seed = task
+    return simulate_batch(character, games, seed, route, accuracy, max_moves)
+
+
+def print_report(report: Dict):
+    print(f"{report['games']} games in {report['seconds']} s ({report['games_per_minute']} per minute)")
+    for character, summary in report["characters"].items():
+        moves, score = summary["moves"], summary["score"]
+        print(f"\n{character} ({CHARACTERS[character].name})")
+        print(f"  finished {summary['finished']:.1%}  died {summary['died']:.1%}  "
+              f"gave up {summary['gave_up']:.1%}")
+        print("  alive after " + "  ".join(f"{points}: {share:.1%}"
+                                           for points, share in summary["survival"].items()))
+        if moves:
+            print(f"  moves  mean {moves['mean']}  p5 {moves['p5']}  p50 {moves['p50']}  p95 {moves['p95']}")
+            print(f"  score  mean {score['mean']}  p5 {score['p5']}  p50 {score['p50']}  p95 {score['p95']}")
+        print(f"  riddles per game {summary['riddles_per_game']}  events per game {summary['events_per_game']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=10000, help="Games per character")
+    parser.add_argument("--characters", nargs="+", choices=sorted(CHARACTERS), default=None,
+                        help="Characters to simulate (default: all)")
+    parser.add_argument("--route", default=None,
+                        help="Comma-separated city order to follow instead of the nearest unsolved city")
+    parser.add_argument("--accuracy", type=float, default=1.0, help="Chance that a riddle guess is right")
+    parser.add_argument("--max-moves", type=int, default=MAX_MOVES, help="Moves after which a player gives up")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", default=None, help="Also write the full report to this file")
+    args = parser.parse_args()
+
+    # Simulate the same world the server is using
+    CONTENT.use(os.environ.get("CONTENT_PACK"))
+
+    route = args.route.split(",") if args.route else None
+    unknown = [name for name in route or () if name not in CITIES]
+    if unknown:
+        parser.error(f"Unknown cities in --route: {', '.join(unknown)}")
+    if not 0 < args.accuracy <= 1:
+        parser.error("--accuracy must be above 0 and at most 1")
+
+    report = simulate(args.characters or list(CHARACTERS), args.games, args.workers, args.batch_size,
+                      args.seed, route, args.accuracy, args.max_moves)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Startup-time audit: how long a worker takes to import the app and serve its first request.
+
+Each run starts a fresh interpreter with `-X importtime`, imports the app,
+serves "/" through the test client and reports the slowest imports:
+
+    python startup_audit.py --runs 5 --top 20
+    python startup_audit.py --json > startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+# Runs inside the child interpreter; prints its timings as JSON on stdout
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get("/", base_url="https://localhost")
+served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000,
+                  "first_request_ms": (served - imported) * 1000,
+                  "total_ms": (served - start) * 1000}))
+"""
+
+
+def parse_importtime(stderr):
+    """Parse `-X importtime` output into (module, self_us, cumulative_us) rows"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def run_probe(cwd):
+    """Time one cold start of the app in a fresh interpreter"""
+    data_dir = tempfile.mkdtemp(prefix="startup-audit-")
+    env = dict(os.environ,
+               SESSION_DB_PATH=os.path.join(data_dir, "sessions.sqlite3"),
+               LEADERBOARD_DB_PATH=os.path.join(data_dir, "leaderboard.sqlite3"),
+               JOURNAL_DIR=os.path.join(data_dir, "journal"),
+               METRICS_DIR=os.path.join(data_dir, "metrics"),
+               PROFILE_DIR=os.path.join(data_dir, "profile"),
+               TILES_PATH=os.path.join(data_dir, "tiles.mbtiles"),
+               ROUTES_DIR=os.path.join(data_dir, "routes"))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=cwd,
+                            env=env, capture_output=True, text=True, check=True)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return timings, parse_importtime(result.stderr)
+
+
+def audit(runs, cwd):
+    """Best-of-`runs` timings and per-module import cost"""
+    best = None
+    cumulative = defaultdict(list)
+    package_self = defaultdict(list)
+    for _ in range(runs):
+        timings, rows = run_probe(cwd)
+        if best is None or timings["total_ms"] < best["total_ms"]:
+            best = timings
+        per_package = defaultdict(int)
+        for name, self_us, cumulative_us in rows:
+            cumulative[name].append(cumulative_us)
+            per_package[name.split(".")[0]] += self_us
+        for package, self_us in per_package.items():
+            package_self[package].append(self_us)
+
+    return {
+        "runs": runs,
+        "timings": {key: round(value, 1) for key, value in best.items()},
+        "modules": sorted(((name, round(min(values) / 1000, 2)) for name, values in cumulative.items()),
+                          key=lambda item: item[1], reverse=True),
+        "packages": sorted(((name, round(min(values) / 1000, 2)) for name, values in package_self.items()),
+                           key=lambda item: item[1], reverse=True)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts to take the best of")
+    parser.add_argument("--top", type=int, default=15, help="Modules and packages to list")
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    args = parser.parse_args()
+
+    report = audit(args.runs, os.path.dirname(os.path.abspath(__file__)))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    timings = report["timings"]
+    print(f"Best of {args.runs} cold starts: import {timings['import_ms']} ms, "
+          f"first request {timings['first_request_ms']} ms, "
+          f"time to first response {timings['total_ms']} ms")
+    print("\nSlowest imports (cumulative ms):")
+    for name, ms in report["modules"][:args.top]:
+        print(f"  {ms:>9.2f}  {name}")
+    print("\nImport cost by top-level package (self ms):")
+    for name, ms in report["packages"][:args.top]:
+        print(f"  {ms:>9.2f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,111 @@
 let canMove = true;
 let lastMoveTime = 0;
 const moveDelay = 100; // Minimum delay between moves in milliseconds
+const moveBatchWindow = 300; // Collect held-key steps for this long before sending them together
+const maxMoveBatch = 50; // Must not exceed MAX_MOVE_BATCH in app.py
+let pendingMoves = [];
+let moveInFlight = false;
+let moveFlushTimer = null;
+let moveView = {}; // Game state as last reported by /move
+let moveViewVersion = null; // Version of moveView acknowledged back to the server
+let heldKeys = []; // Movement keys held down, in the order they were pressed
+
+// Persistent real-time channel: actions go up with fetch, results come back
+// over Server-Sent Events. Plain HTTP routes are used whenever it is down.
+const realtime = {
+    source: null,
+    channel: null,
+    tickMs: null, // Set when the server moves held keys itself
+    nextId: 1,
+    pending: new Map()
+};
+const realtimeTimeout = 10000; // Give up waiting for a pushed result after this many ms
+const httpRoutes = {
+    move: '/move',
+    solve_riddle: '/solve_riddle',
+    handle_event: '/handle_event',
+    check_location: '/check_location'
+};
+
+function connectRealtime() {
+    if (!window.REALTIME_URL || !window.EventSource) return;
+
+    const source = new EventSource(`${window.REALTIME_URL}/events`, { withCredentials: true });
+    source.addEventListener('hello', event => {
+        const hello = JSON.parse(event.data);
+        realtime.channel = hello.channel;
+        realtime.tickMs = hello.tick_ms || null;
+    });
+    source.addEventListener('state', event => {
+        // Pushed by the server's tick engine while we hold a key
+        const data = JSON.parse(event.data);
+        moveView = { ...moveView, ...data };
+        // The server's copy of moveView no longer matches ours
+        moveViewVersion = null;
+        applyMoveView(data);
+    });
+    source.addEventListener('result', event => {
+        const message = JSON.parse(event.data);
+        const pending = realtime.pending.get(message.id);
+        if (pending) {
+            realtime.pending.delete(message.id);
+            clearTimeout(pending.timer);
+            pending.resolve(message.data);
+        }
+    });
+    source.onerror = () => {
+        // EventSource reconnects by itself; use HTTP until we get a new channel
+        realtime.channel = null;
+        realtime.tickMs = null;
+    };
+    realtime.source = source;
+}
+
+// Send a game action over the real-time channel, falling back to HTTP
+function callGame(type, payload) {
+    if (!realtime.channel) {
+        if (type === 'check_location') {
+            return fetch(`${httpRoutes[type]}?${new URLSearchParams(payload)}`)
+                .then(response => response.json());
+        }
+        return fetch(httpRoutes[type], {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(payload)
+        }).then(response => response.json());
+    }
+
+    const id = realtime.nextId++;
+    return new Promise((resolve, reject) => {
+        const timer = setTimeout(() => {
+            realtime.pending.delete(id);
+            reject(new Error('Timed out waiting for the real-time channel'));
+        }, realtimeTimeout);
+        realtime.pending.set(id, { resolve, timer });
+
+        fetch(`${window.REALTIME_URL}/send`, {
+            method: 'POST',
+            credentials: 'include',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ channel: realtime.channel, id: id, type: type, payload: payload })
+        })
+        .then(response => {
+            if (!response.ok) throw new Error(`Real-time channel rejected message (${response.status})`);
+        })
+        .catch(error => {
+            realtime.pending.delete(id);
+            clearTimeout(timer);
+            realtime.channel = null;
+            reject(error);
+        });
+    });
+}
+
+connectRealtime();
 
 window.addEventListener('load', async () => {
     try {
@@ -29,7 +134,16 @@ document.addEventListener('keydown', function(e) {
     const key = e.key.toLowerCase();
     if (['w', 'a', 's', 'd'].includes(key)) {
         e.preventDefault(); // Prevent page scrolling
-        
+
+        // The server moves us every tick while the key is held
+        if (realtime.channel && realtime.tickMs) {
+            if (!heldKeys.includes(key)) {
+                heldKeys.push(key);
+                sendIntent();
+            }
+            return;
+        }
+
         // Rate limit the movement
         const now = Date.now();
         if (now - lastMoveTime >= moveDelay) {
@@ -39,6 +153,32 @@ document.addEventListener('keydown', function(e) {
     }
 });
 
+document.addEventListener('keyup', function(e) {
+    const key = e.key.toLowerCase();
+    if (heldKeys.includes(key)) {
+        heldKeys = heldKeys.filter(held => held !== key);
+        sendIntent();
+    }
+});
+
+// Keyup never arrives once the window loses focus, so stop moving
+window.addEventListener('blur', function() {
+    if (heldKeys.length > 0) {
+        heldKeys = [];
+        sendIntent();
+    }
+});
+
+// Tell the real-time server which movement keys are held
+function sendIntent() {
+    if (!realtime.channel) return;
+    callGame('intent', { keys: heldKeys })
+    .then(data => {
+        if (data.error) showMessage(data.error, "error");
+    })
+    .catch(error => console.error('Error:', error));
+}
+
 // Add focus handling to ensure map controls work even when iframe loses focus
 const mapIframe = document.querySelector('.map-container iframe');
 if (mapIframe) {
@@ -71,98 +211,139 @@ document.querySelectorAll('.controls button').forEach(button => {
 // Handle WASD movement
 function move(direction) {
     if (!canMove) return;
-    
-    fetch('/move', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ direction: direction })
+
+    pendingMoves.push({ direction: direction, time: Date.now() });
+
+    // Single taps go out straight away, held keys are collected into one batch
+    if (pendingMoves.length >= maxMoveBatch || (!moveInFlight && !moveFlushTimer)) {
+        flushMoves();
+    } else if (!moveFlushTimer) {
+        moveFlushTimer = setTimeout(flushMoves, moveBatchWindow);
+    }
+}
+
+// Send all queued steps to the server in a single request
+function flushMoves() {
+    clearTimeout(moveFlushTimer);
+    moveFlushTimer = null;
+    if (moveInFlight || pendingMoves.length === 0) return;
+
+    const batch = pendingMoves.splice(0, maxMoveBatch);
+    moveInFlight = true;
+
+    callGame('move', {
+        directions: batch.map(step => step.direction),
+        timestamps: batch.map(step => step.time),
+        version: moveViewVersion
     })
-    .then(response => response.json())
     .then(data => {
         if (data.error) {
             showMessage(data.error, "error");
             return;
         }
 
-        // Update player position on the map
-        if (data.position) {
-            const iframe = document.querySelector('iframe');
-            if (iframe) {
-                iframe.contentWindow.postMessage({
-                    type: 'updatePosition',
-                    lat: data.position[0],
-                    lon: data.position[1]
-                }, '*');
-            }
+        // Merge the changed fields into our copy of the game state
+        if (data.version !== undefined) {
+            moveView = data.full ? { ...data } : { ...moveView, ...data };
+            moveViewVersion = data.version;
+        }
+        applyMoveView(data);
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        showMessage('An error occurred while moving', 'error');
+    })
+    .finally(() => {
+        moveInFlight = false;
+        if (pendingMoves.length > 0 && !moveFlushTimer) {
+            moveFlushTimer = setTimeout(flushMoves, moveBatchWindow);
+        }
+    });
+}
+
+// Update the page from a move result; data holds the fields that changed
+function applyMoveView(data) {
+    const view = moveView;
+
+    // Update player position on the map
+    if (data.position) {
+        const iframe = document.querySelector('iframe');
+        if (iframe) {
+            iframe.contentWindow.postMessage({
+                type: 'updatePosition',
+                lat: data.position[0],
+                lon: data.position[1]
+            }, '*');
         }
+    }
 
-        // Update nearest city and distance
-        if (data.nearest_city) {
+    // Update nearest city and distance
+    if ('nearest_city' in data || 'distance' in data) {
+        if (view.nearest_city) {
             document.getElementById('distance').textContent = 
-                `${Math.round(data.distance * 100) / 100} km`;
-            document.getElementById('status').textContent = `Near ${data.nearest_city}`;
+                `${Math.round(view.distance * 100) / 100} km`;
+            document.getElementById('status').textContent = `Near ${view.nearest_city}`;
         } else {
             document.getElementById('status').textContent = 'Exploring...';
         }
+    }
 
-        // Update stamina
-        if (data.stamina !== undefined) {
-            updateStaminaBar(data.stamina);
-        }
+    // Update stamina
+    if (data.stamina !== undefined) {
+        updateStaminaBar(data.stamina);
+    }
 
-        // Update score
-        if (data.score !== undefined) {
-            document.getElementById('score-counter').textContent = data.score;
-        }
+    // Update score
+    if (data.score !== undefined) {
+        document.getElementById('score-counter').textContent = data.score;
+    }
 
-        // Update moves counter
-        if (data.moves !== undefined) {
-            document.getElementById('moves-counter').textContent = data.moves;
-        }
+    // Update moves counter
+    if (data.moves !== undefined) {
+        document.getElementById('moves-counter').textContent = data.moves;
+    }
 
-        // Update cities visited
-        if (data.cities_visited !== undefined && data.total_cities !== undefined) {
-            document.getElementById('main-cities-count').textContent = `${data.cities_visited}/${data.total_cities}`;
-            document.getElementById('cities-visited').textContent = `${data.cities_visited}/${data.total_cities}`;
-        }
+    // Update cities visited
+    if (data.cities_visited !== undefined || data.total_cities !== undefined) {
+        document.getElementById('main-cities-count').textContent = `${view.cities_visited}/${view.total_cities}`;
+        document.getElementById('cities-visited').textContent = `${view.cities_visited}/${view.total_cities}`;
+    }
 
-        // Update current location
-        if (data.current_city) {
-            document.getElementById('main-current-location').textContent = data.current_city;
-            document.getElementById('current-location').textContent = data.current_city;
-        }
+    // Update current location
+    if (data.current_city) {
+        document.getElementById('main-current-location').textContent = data.current_city;
+        document.getElementById('current-location').textContent = data.current_city;
+    }
 
-        // Handle château reveal
-        if (data.chateau_revealed) {
-            document.getElementById('chateau-reveal').style.display = 'flex';
-            handleMysteriousLocation(data);
-        }
+    // Handle château reveal
+    if (data.chateau_revealed) {
+        document.getElementById('chateau-reveal').style.display = 'flex';
+        handleMysteriousLocation(view);
+    }
 
-        // Handle château arrival
-        if (data.at_chateau) {
-            // document.getElementById('chateau-arrival').style.display = 'flex';
-            handleMysteriousLocation(data);
-        }
+    // Handle château arrival
+    if (data.at_chateau) {
+        // document.getElementById('chateau-arrival').style.display = 'flex';
+        handleMysteriousLocation(view);
+    }
 
-        // Handle game completion
-        if (data.game_completed && data.redirect) {
-            showMessage("Congratulations! You have completed your quest!", "success");
-            setTimeout(() => {
-                window.location.href = data.redirect;
-            }, 2000);
-        }
+    // Handle game completion
+    if (data.game_completed && data.redirect) {
+        showMessage("Congratulations! You have completed your quest!", "success");
+        setTimeout(() => {
+            window.location.href = data.redirect;
+        }, 2000);
+    }
 
-        // Handle city entry and riddle
-        if (data.in_city && data.current_riddle) {
-            handleCityEntry(data);
-        }
-    })
-    .catch(error => {
-        console.error('Error:', error);
-        showMessage('An error occurred while moving', 'error');
-    });
+    // Handle city entry and riddle
+    if (view.in_city && view.current_riddle) {
+        handleCityEntry(view);
+    }
+
+    // Handle a random event on the road
+    if (data.event) {
+        showEventModal(data.event);
+    }
 }
 
 // Handle city entry
@@ -180,8 +361,9 @@ function handleCityEntry(data) {
     overlay.style.display = 'block';
     modal.style.display = 'block';
     
-    // Disable movement
+    // Disable movement and drop steps queued after entering the city
     canMove = false;
+    pendingMoves = [];
     document.querySelector('.controls').classList.add('disabled');
     
     // Clear and focus the input
@@ -217,20 +399,15 @@ function showEventModal(event) {
     });
     
     eventModal.style.display = 'flex';
+    // Disable movement and drop steps queued after the event
     canMove = false;
+    pendingMoves = [];
     document.querySelector('.controls').classList.add('disabled');
 }
 
 // Handle event choices
 function handleEventChoice(choice) {
-    fetch('/handle_event', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ choice: choice })
-    })
-    .then(response => response.json())
+    callGame('handle_event', { choice: choice })
     .then(data => {
         if (data.success) {
             // Update game state
@@ -242,6 +419,12 @@ function handleEventChoice(choice) {
             document.getElementById('current-location').textContent = data.current_city || "Exploring";
             document.getElementById('moves-counter').textContent = data.moves;
             document.getElementById('score-counter').textContent = data.score;
+            showAchievements(data.achievements);
+            if (data.bonus === 'favoured') {
+                showMessage('Fortune smiles on you: it turned out better than expected!', 'success');
+            } else if (data.bonus === 'unfavoured') {
+                showMessage('Luck is not on your side: it turned out worse than expected.', 'error');
+            }
             
             // Update companions list
             const companionsList = document.getElementById('companions-list');
@@ -329,6 +512,7 @@ function completeGameAndRedirect() {
     .then(data => {
         if (data.success) {
             showMessage("Congratulations! Your quest is complete!", "success");
+            showAchievements(data.achievements);
             setTimeout(() => {
                 window.location.href = '/leaderboard';
             }, 2000);
@@ -365,14 +549,7 @@ function handleRiddleSubmit(event) {
         return;
     }
     
-    fetch('/solve_riddle', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ answer: answer })
-    })
-    .then(response => response.json())
+    callGame('solve_riddle', { answer: answer })
     .then(data => {
         if (data.success) {
             // Update cities visited count
@@ -389,6 +566,10 @@ function handleRiddleSubmit(event) {
             
             // Show success message
             showMessage(data.message, 'success');
+            showAchievements(data.achievements);
+            if (data.route_hint) {
+                showMessage(`Next: ${data.route_hint.destination} is at least ${data.route_hint.moves} moves away`, 'info');
+            }
             
             // Update companions list if provided
             if (data.companions) {
@@ -470,6 +651,17 @@ function showMessage(message, type) {
     setTimeout(() => messageDiv.remove(), 5000);
 }
 
+// Announce newly unlocked achievements and mark them in the sidebar
+function showAchievements(achievements) {
+    (achievements || []).forEach(achievement => {
+        showMessage(`${achievement.icon} Achievement unlocked: ${achievement.name} (+${achievement.points})`, 'success');
+        const block = document.querySelector(`[data-achievement="${achievement.key}"]`);
+        if (block) {
+            block.classList.add('unlocked');
+        }
+    });
+}
+
 // Add follower update function if not already present
 function updateCompanions(companions) {
     const companionsList = document.getElementById('companions-list');
@@ -0,0 +1,302 @@
+"""Fixed-rate movement simulation for the players on the real-time channel.
+
+Instead of sending one request per step, players tell the server which
+key they are holding. The engine keeps every such player's position,
+stamina and held direction in NumPy arrays and advances everyone who is
+moving by one step per tick, following the rules of
+game_actions.apply_move_step. The stamina rules, the city and château
+triggers (triggers.TriggerTable) and the rolls for random events on the
+road are computed for the whole population at once. Only players whose
+city status changes or who run into an event are handled one at a time.
+"""
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from events import public_event
+from game_actions import (
+    CHATEAU_LOCATION, MOVE_DELAY_MS, MOVEMENT_SPEED, MYSTERIOUS_LOCATION, city_triggers,
+    event_trigger
+)
+from game_content import CITIES
+from game_mechanics import CHARACTERS
+from metrics import DEATHS
+from triggers import haversine_km_array
+
+# One step per tick: the rate the client used to throttle held keys to
+TICK_INTERVAL = MOVE_DELAY_MS / 1000
+
+# (latitude, longitude) sign of a step for each key
+DIRECTIONS = {"w": (1, 0), "s": (-1, 0), "a": (0, -1), "d": (0, 1)}
+
+
+class TickEngine:
+    """Movement state of every player in tick mode, one array slot per player"""
+
+    def __init__(self, capacity: int = 256, seed: Optional[int] = None):
+        self.rng = np.random.default_rng(seed)
+        self.slots: Dict[str, int] = {}
+        self.sids: List[Optional[str]] = []
+        # Per-player data that changes rarely enough not to need an array
+        self.players: List[Optional[Dict]] = []
+        self._free: List[int] = []
+        # Names of the trigger table the nearest-city numbers refer to (it changes on content reloads)
+        self.city_names: List[str] = city_triggers().names
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        old = len(self.sids)
+        arrays = {
+            "lat": np.float64, "lon": np.float64, "stamina": np.float64,
+            "distance": np.float64, "nearest_distance": np.float64,
+            "speed": np.float64, "stamina_bonus": np.float64, "deadly_chance": np.float64,
+            "moves": np.int64, "nearest": np.int64,
+            "dlat": np.int8, "dlon": np.int8,
+            "active": np.bool_, "has_died": np.bool_, "in_city": np.bool_, "all_solved": np.bool_,
+            "pending_event": np.bool_,
+        }
+        for name, dtype in arrays.items():
+            array = np.zeros(capacity, dtype=dtype)
+            if old:
+                array[:old] = getattr(self, name)
+            setattr(self, name, array)
+        self.sids.extend([None] * (capacity - old))
+        self.players.extend([None] * (capacity - old))
+        self._free.extend(range(capacity - 1, old - 1, -1))
+
+    def __contains__(self, sid: str) -> bool:
+        return sid in self.slots
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def join(self, sid: str, game_state: Dict):
+        """Start simulating a player from their stored game state"""
+        if sid in self.slots:
+            self.update(sid, game_state)
+            return
+        if game_state.get("character") not in CHARACTERS or not game_state.get("player_position"):
+            raise ValueError("Game not started")
+        if not self._free:
+            self._allocate(len(self.sids) * 2)
+        slot = self._free.pop()
+        self.slots[sid] = slot
+        self.sids[slot] = sid
+        self.active[slot] = True
+        self.dlat[slot] = self.dlon[slot] = 0
+        self._load(slot, game_state)
+
+    def _load(self, slot: int, game_state: Dict):
+        character = CHARACTERS[game_state["character"]]
+        self.lat[slot], self.lon[slot] = game_state["player_position"]
+        self.stamina[slot] = game_state["stamina"]
+        self.moves[slot] = game_state["moves"]
+        self.distance[slot] = game_state["total_distance"]
+        self.has_died[slot] = game_state.get("has_died", False)
+        self.in_city[slot] = game_state.get("in_city", False)
+        self.all_solved[slot] = len(game_state["riddles_solved"]) >= len(CITIES)
+        self.pending_event[slot] = bool(game_state.get("current_event"))
+        self.speed[slot] = MOVEMENT_SPEED * character.move_multiplier
+        self.stamina_bonus[slot] = character.stamina_bonus
+        self.deadly_chance[slot] = character.deadly_event_chance
+        self.nearest[slot] = -1
+        self.players[slot] = {
+            "character": character,
+            "character_key": game_state["character"],
+            "riddles_solved": list(game_state["riddles_solved"]),
+            "death_message": game_state.get("death_message", ""),
+            "current_city": game_state.get("current_city"),
+            "current_riddle": game_state.get("current_riddle"),
+            "mysterious_location_revealed": game_state.get("mysterious_location_revealed", False),
+            "chateau_revealed": game_state.get("chateau_revealed", False),
+            "at_chateau": game_state.get("at_chateau", False),
+            "current_event": game_state.get("current_event"),
+        }
+
+    def update(self, sid: str, game_state: Dict):
+        """Reload a player after something outside the engine changed their game state"""
+        self._load(self.slots[sid], game_state)
+
+    def leave(self, sid: str) -> Dict:
+        """Stop simulating a player, returning their final engine fields"""
+        fields = self.fields(sid)
+        slot = self.slots.pop(sid)
+        self.sids[slot] = None
+        self.players[slot] = None
+        self.active[slot] = False
+        self.dlat[slot] = self.dlon[slot] = 0
+        self._free.append(slot)
+        return fields
+
+    def set_intent(self, sid: str, keys: Iterable[str]):
+        """Set the keys a player is holding, in the order they were pressed.
+
+        As with keyboard auto-repeat, only the most recently pressed
+        movement key moves the player.
+        """
+        slot = self.slots[sid]
+        held = [key.lower() for key in keys if key.lower() in DIRECTIONS]
+        self.dlat[slot], self.dlon[slot] = DIRECTIONS[held[-1]] if held else (0, 0)
+
+    def is_moving(self, sid: str) -> bool:
+        slot = self.slots[sid]
+        return bool(self.dlat[slot] or self.dlon[slot])
+
+    def moving_sids(self) -> List[str]:
+        moving = np.flatnonzero(self.active & ((self.dlat != 0) | (self.dlon != 0)))
+        return [self.sids[slot] for slot in moving]
+
+    def fields(self, sid: str) -> Dict:
+        """The game_state fields the engine is authoritative for while the player is in it"""
+        slot = self.slots[sid]
+        player = self.players[slot]
+        return {
+            "player_position": [float(self.lat[slot]), float(self.lon[slot])],
+            "stamina": float(self.stamina[slot]),
+            "moves": int(self.moves[slot]),
+            "total_distance": float(self.distance[slot]),
+            "has_died": bool(self.has_died[slot]),
+            "death_message": player["death_message"],
+            "in_city": bool(self.in_city[slot]),
+            "current_city": player["current_city"],
+            "current_riddle": player["current_riddle"],
+            "mysterious_location_revealed": player["mysterious_location_revealed"],
+            "chateau_revealed": player["chateau_revealed"],
+            "at_chateau": player["at_chateau"],
+            "current_event": player["current_event"],
+        }
+
+    def view(self, sid: str) -> Dict:
+        """The player's state in the shape of a full /move response"""
+        slot = self.slots[sid]
+        player = self.players[slot]
+        nearest = int(self.nearest[slot])
+        revealed = player["mysterious_location_revealed"]
+        return {
+            "position": [float(self.lat[slot]), float(self.lon[slot])],
+            "nearest_city": self.city_names[nearest] if nearest >= 0 else None,
+            "distance": float(self.nearest_distance[slot]) if nearest >= 0 else None,
+            "stamina": float(self.stamina[slot]),
+            "moves": int(self.moves[slot]),
+            "mysterious_location_revealed": revealed,
+            "mysterious_location": MYSTERIOUS_LOCATION if revealed else None,
+            "chateau_location": CHATEAU_LOCATION,
+            "cities_visited": len(player["riddles_solved"]),
+            "total_cities": len(CITIES),
+            "current_city": player["current_city"],
+            "in_city": bool(self.in_city[slot]),
+            "current_riddle": player["current_riddle"] if self.in_city[slot] else None,
+        }
+
+    def tick(self) -> Dict[str, Dict]:
+        """Advance every moving player by one step.
+
+        Returns the one-off events of this tick (deaths, city entries and
+        exits, château reveal and arrival, random events) keyed by session id.
+        """
+        moving = np.flatnonzero(self.active & ((self.dlat != 0) | (self.dlon != 0)))
+        if not len(moving):
+            return {}
+        events: Dict[str, Dict] = {}
+
+        # Move, slower when tired
+        stamina = self.stamina[moving]
+        speed = self.speed[moving] * np.where(stamina < 20, 0.5, 1.0)
+        old_lat, old_lon = self.lat[moving], self.lon[moving]
+        self.lat[moving] = old_lat + self.dlat[moving] * speed
+        self.lon[moving] = old_lon + self.dlon[moving] * speed
+        self.moves[moving] += 1
+
+        # Rare deadly events end the step early, exactly as in apply_move_step
+        died = ~self.has_died[moving] & (self.rng.random(len(moving)) < self.deadly_chance[moving])
+        for slot in moving[died]:
+            player = self.players[slot]
+            self.has_died[slot] = True
+            self.dlat[slot] = self.dlon[slot] = 0
+            player["death_message"] = player["character"].deadly_event
+            DEATHS.inc(player["character_key"])
+            events[self.sids[slot]] = {
+                "game_over": True,
+                "message": f"Oh no! {player['character'].deadly_event}"
+            }
+        alive = ~died
+        slots, stamina = moving[alive], stamina[alive]
+        old_lat, old_lon = old_lat[alive], old_lon[alive]
+
+        # Stamina cost and random regeneration
+        bonus = self.stamina_bonus[slots]
+        stamina = np.where(stamina > 0, np.maximum(0, stamina - 0.2 * (1.0 - bonus)), stamina)
+        regen = self.rng.random(len(slots)) < 0.15
+        stamina = np.where(regen, np.minimum(100, stamina + 10 * (1.0 + bonus)), stamina)
+        self.stamina[slots] = stamina
+
+        # Distance travelled, then the nearest city and triggers for everyone
+        lat, lon = self.lat[slots], self.lon[slots]
+        self.distance[slots] += haversine_km_array(np.radians(old_lat), np.radians(old_lon),
+                                                   np.radians(lat), np.radians(lon))
+        table = city_triggers()
+        batch = table.evaluate(lat, lon, exact_nearest=False)
+        self.city_names = table.names
+        nearest, in_city = batch.nearest, batch.in_city
+        self.nearest[slots] = nearest
+        self.nearest_distance[slots] = batch.distance
+
+        solved = self.all_solved[slots]
+        self._check_chateau(slots[solved], batch.landmarks["reveal"][solved],
+                            batch.landmarks["at_chateau"][solved], events)
+
+        # Entering and leaving cities
+        changed = in_city != self.in_city[slots]
+        for slot, entered, city in zip(slots[changed], in_city[changed], nearest[changed]):
+            player = self.players[slot]
+            self.in_city[slot] = entered
+            sid = self.sids[slot]
+            if entered:
+                city_name = table.names[city]
+                player["current_city"] = city_name
+                if city_name not in player["riddles_solved"]:
+                    player["current_riddle"] = CITIES[city_name].riddle
+                    # The riddle modal opens, so the player stops
+                    self.dlat[slot] = self.dlon[slot] = 0
+                else:
+                    player["current_riddle"] = None
+                events.setdefault(sid, {})["entered_city"] = city_name
+            else:
+                player["current_city"] = None
+                player["current_riddle"] = None
+                events.setdefault(sid, {})["left_city"] = True
+
+        self._roll_events(slots, nearest, table.names, events)
+        return events
+
+    def _roll_events(self, slots: np.ndarray, nearest: np.ndarray, names: List[str],
+                     events: Dict[str, Dict]):
+        """Random events for the players on the road, one roll each as in apply_move_step"""
+        trigger = event_trigger()
+        road = ~self.in_city[slots] & ~self.pending_event[slots]
+        fired = road & (self.rng.random(len(slots)) < trigger.chance)
+        for slot, city in zip(slots[fired], nearest[fired]):
+            player = self.players[slot]
+            event = trigger.pick(self.rng, names[city], player["character_key"])
+            if event is None:
+                continue
+            player["current_event"] = event
+            self.pending_event[slot] = True
+            # The event modal opens, so the player stops
+            self.dlat[slot] = self.dlon[slot] = 0
+            events.setdefault(self.sids[slot], {})["event"] = public_event(event)
+
+    def _check_chateau(self, slots: np.ndarray, near_mystery: np.ndarray,
+                       near_chateau: np.ndarray, events: Dict[str, Dict]):
+        """Reveal and arrival checks for players who have solved every riddle"""
+        for slot in slots:
+            self.players[slot]["mysterious_location_revealed"] = True
+        nearby = near_mystery | near_chateau
+        for slot, mystery, chateau in zip(slots[nearby], near_mystery[nearby], near_chateau[nearby]):
+            player = self.players[slot]
+            if mystery and not player["chateau_revealed"]:
+                player["chateau_revealed"] = True
+                events.setdefault(self.sids[slot], {})["chateau_revealed"] = True
+            if chateau and not player["at_chateau"]:
+                player["at_chateau"] = True
+                events.setdefault(self.sids[slot], {})["at_chateau"] = True
@@ -0,0 +1,269 @@
+"""Map tiles served by the app from a local MBTiles archive.
+
+The archive is an MBTiles SQLite file (one tiles table keyed by zoom,
+column and TMS row) read through SQLite's memory-mapped I/O, so serving a
+cached tile is an index lookup and a copy out of the page cache. It is
+seeded ahead of time with the tiles covering the game area:
+
+    python tiles.py seed                  # zooms 3-8 around the game's cities
+    python tiles.py seed --max-zoom 10
+    python tiles.py vendor-leaflet        # copy Leaflet into static/vendor/leaflet
+    python tiles.py stats
+
+A tile missing from the archive is fetched once from TILES_UPSTREAM,
+stored and served; concurrent requests for the same tile wait for that
+one fetch. Only tiles inside the game area and up to MAX_ZOOM are
+fetched, so the endpoint can't be used as an open proxy.
+"""
+import argparse
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import urllib.request
+from typing import Dict, Iterator, Optional, Tuple
+
+from flask import Blueprint, abort, current_app, request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPSTREAM = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+USER_AGENT = "cvi-tile-cache/1.0"
+
+# Tiles can change upstream, so they are cached for a week and revalidated by ETag
+CACHE_CONTROL = "public, max-age=604800, stale-while-revalidate=86400"
+
+# Zoom levels seeded by default and the deepest zoom fetched on a miss
+SEED_ZOOMS = (3, 8)
+MAX_ZOOM = 12
+
+# Lat/lon box around London, Berlin, Geneva and the château, plus some margin
+GAME_BOUNDS = (42.5, -3.0, 54.0, 16.0)  # south, west, north, east
+
+# Bytes of the archive SQLite may map into memory
+MMAP_SIZE = 256 * 1024 * 1024
+
+LEAFLET_VERSION = "1.7.1"
+LEAFLET_FILES = ("leaflet.js", "leaflet.css", "images/layers.png", "images/layers-2x.png",
+                 "images/marker-icon.png", "images/marker-icon-2x.png", "images/marker-shadow.png")
+
+tiles = Blueprint("tiles", __name__)
+
+
+def tile_range(bounds: Tuple[float, float, float, float], zoom: int) -> Tuple[int, int, int, int]:
+    """Web Mercator tile columns and rows (XYZ) covering a lat/lon box at a zoom"""
+    south, west, north, east = bounds
+    n = 2 ** zoom
+
+    def column(lon):
+        return min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+
+    def row(lat):
+        lat = math.radians(lat)
+        y = (1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n
+        return min(n - 1, max(0, int(y)))
+
+    return column(west), row(north), column(east), row(south)
+
+
+def tiles_in(bounds, min_zoom: int, max_zoom: int) -> Iterator[Tuple[int, int, int]]:
+    for zoom in range(min_zoom, max_zoom + 1):
+        x0, y0, x1, y1 = tile_range(bounds, zoom)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                yield zoom, x, y
+
+
+class TileArchive:
+    """Tiles in an MBTiles file, with misses filled from an upstream server"""
+
+    def __init__(self, path: str, upstream: Optional[str] = DEFAULT_UPSTREAM,
+                 bounds=GAME_BOUNDS, max_zoom: int = MAX_ZOOM, timeout: float = 10.0):
+        self.path = path
+        self.upstream = upstream
+        self.bounds = bounds
+        self.max_zoom = max_zoom
+        self.timeout = timeout
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._fetching: Dict[Tuple[int, int, int], threading.Event] = {}
+        self._fetching_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS tiles (
+                    zoom_level INTEGER NOT NULL,
+                    tile_column INTEGER NOT NULL,
+                    tile_row INTEGER NOT NULL,
+                    tile_data BLOB NOT NULL,
+                    PRIMARY KEY (zoom_level, tile_column, tile_row)
+                ) WITHOUT ROWID;
+            """)
+            south, west, north, east = bounds
+            conn.executemany("INSERT OR IGNORE INTO metadata VALUES (?, ?)", [
+                ("name", "cvi"), ("format", "png"), ("type", "baselayer"),
+                ("bounds", f"{west},{south},{east},{north}"),
+                ("minzoom", str(SEED_ZOOMS[0])), ("maxzoom", str(max_zoom)),
+                ("attribution", "© OpenStreetMap contributors"),
+            ])
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            self._local.conn = conn
+        return conn
+
+    def in_area(self, zoom: int, x: int, y: int) -> bool:
+        """Whether a tile is one the game's map can show"""
+        if not 0 <= zoom <= self.max_zoom:
+            return False
+        x0, y0, x1, y1 = tile_range(self.bounds, zoom)
+        return x0 <= x <= x1 and y0 <= y <= y1
+
+    def get(self, zoom: int, x: int, y: int) -> Optional[bytes]:
+        # MBTiles rows count from the south (TMS), map URLs from the north (XYZ)
+        row = self._connect().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (zoom, x, (1 << zoom) - 1 - y)).fetchone()
+        return row[0] if row else None
+
+    def put(self, zoom: int, x: int, y: int, data: bytes):
+        with self._write_lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                         (zoom, x, (1 << zoom) - 1 - y, data))
+
+    def fetch(self, zoom: int, x: int, y: int) -> bytes:
+        url = self.upstream.format(z=zoom, x=x, y=y)
+        req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            return response.read()
+
+    def tile(self, zoom: int, x: int, y: int) -> Optional[bytes]:
+        """A tile from the archive, fetched and stored first if it is missing"""
+        data = self.get(zoom, x, y)
+        if data is not None or not self.upstream or not self.in_area(zoom, x, y):
+            return data
+
+        key = (zoom, x, y)
+        with self._fetching_lock:
+            pending = self._fetching.get(key)
+            if pending is None:
+                self._fetching[key] = threading.Event()
+        if pending is not None:
+            # Another request is already fetching it
+            pending.wait(self.timeout)
+            return self.get(zoom, x, y)
+
+        try:
+            data = self.fetch(zoom, x, y)
+            self.put(zoom, x, y, data)
+            return data
+        except (OSError, ValueError):
+            logger.warning("Could not fetch tile %d/%d/%d", zoom, x, y, exc_info=True)
+            return None
+        finally:
+            with self._fetching_lock:
+                self._fetching.pop(key).set()
+
+    def seed(self, min_zoom: int, max_zoom: int) -> Dict:
+        """Fetch every missing tile of the game area between two zooms"""
+        stored = skipped = failed = 0
+        for zoom, x, y in tiles_in(self.bounds, min_zoom, max_zoom):
+            if self.get(zoom, x, y) is not None:
+                skipped += 1
+                continue
+            try:
+                self.put(zoom, x, y, self.fetch(zoom, x, y))
+                stored += 1
+            except (OSError, ValueError):
+                logger.warning("Could not fetch tile %d/%d/%d", zoom, x, y, exc_info=True)
+                failed += 1
+        return {"stored": stored, "already_stored": skipped, "failed": failed}
+
+    def stats(self) -> Dict:
+        rows = self._connect().execute(
+            "SELECT zoom_level, COUNT(*), SUM(LENGTH(tile_data)) FROM tiles GROUP BY zoom_level").fetchall()
+        return {"zooms": {zoom: {"tiles": count, "bytes": size} for zoom, count, size in rows},
+                "tiles": sum(count for _, count, _ in rows)}
+
+
+def vendor_leaflet(static_folder: str, base_url: str) -> str:
+    """Download the Leaflet release the map uses into static/vendor/leaflet"""
+    target = os.path.join(static_folder, "vendor", "leaflet")
+    for name in LEAFLET_FILES:
+        path = os.path.join(target, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        req = urllib.request.Request(f"{base_url}/{name}", headers={"User-Agent": USER_AGENT})
+        with urllib.request.urlopen(req, timeout=30) as response, open(path, "wb") as f:
+            f.write(response.read())
+    return target
+
+
+def init_tiles(app):
+    """Serve map tiles at /tiles and use the vendored Leaflet when it is present"""
+    app.extensions["tiles"] = TileArchive(app.config["TILES_PATH"],
+                                          app.config["TILES_UPSTREAM"] or None)
+    app.register_blueprint(tiles)
+    leaflet = os.path.join(app.static_folder, "vendor", "leaflet", "leaflet.js")
+    app.add_template_global(os.path.exists(leaflet), "LEAFLET_LOCAL")
+    app.add_template_global(LEAFLET_VERSION, "LEAFLET_VERSION")
+    app.add_template_global(MAX_ZOOM, "TILES_MAX_ZOOM")
+
+
+@tiles.route("/tiles/<int:zoom>/<int:x>/<int:y>.png")
+def serve_tile(zoom, x, y):
+    data = current_app.extensions["tiles"].tile(zoom, x, y)
+    if data is None:
+        abort(404)
+
+    etag = hashlib.blake2b(data, digest_size=8).hexdigest()
+    response = current_app.response_class(mimetype="image/png")
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.set_etag(etag)
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+    response.set_data(data)
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", default=os.environ.get("TILES_PATH", os.path.join("instance", "tiles.mbtiles")),
+                        help="MBTiles archive")
+    parser.add_argument("--upstream", default=os.environ.get("TILES_UPSTREAM", DEFAULT_UPSTREAM),
+                        help="Tile URL template to fetch from")
+    commands = parser.add_subparsers(dest="command", required=True)
+    seed = commands.add_parser("seed", help="Fetch the game area's tiles into the archive")
+    seed.add_argument("--min-zoom", type=int, default=SEED_ZOOMS[0])
+    seed.add_argument("--max-zoom", type=int, default=SEED_ZOOMS[1])
+    leaflet = commands.add_parser("vendor-leaflet", help="Copy Leaflet into static/vendor/leaflet")
+    leaflet.add_argument("--from", dest="base_url",
+                         default=f"https://unpkg.com/leaflet@{LEAFLET_VERSION}/dist")
+    commands.add_parser("stats", help="Count the stored tiles per zoom")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.command == "vendor-leaflet":
+        static_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+        print(vendor_leaflet(static_folder, args.base_url))
+        return
+    archive = TileArchive(args.path, args.upstream)
+    if args.command == "seed":
+        if args.max_zoom > MAX_ZOOM:
+            parser.error(f"--max-zoom can be at most {MAX_ZOOM}")
+        print(archive.seed(args.min_zoom, args.max_zoom))
+    else:
+        print(archive.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Nearest-city and trigger checks for many positions at once.
+
+A TriggerTable holds the city coordinates and a few landmarks (with their
+trigger radii) as NumPy arrays. evaluate() takes N positions and works
+out every player's nearest city, distance, in-city flag and landmark flags
+in one vectorised haversine pass, and check() answers for one position
+through a ProximityIndex over the cities. Both only fall back to geopy's
+geodesic for the few rows where the sphere could give a different answer:
+near-ties between cities, or distances close to a threshold.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from proximity import EARTH_RADIUS_KM, SPHERE_ERROR, ProximityIndex, geodesic_km, haversine_km, near_boundary
+
+# How far apart two haversine distances must be for their order to be certain
+TIE_FACTOR = (1 + SPHERE_ERROR) / (1 - SPHERE_ERROR)
+
+
+def haversine_km_array(lat1, lon1, lat2, lon2):
+    """Element-wise (broadcasting) great-circle distance for arrays of radians"""
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def near_boundary_array(distance_km, boundary_km):
+    """Vectorised proximity.near_boundary"""
+    return np.abs(distance_km - boundary_km) <= boundary_km * SPHERE_ERROR / (1 - SPHERE_ERROR) + 1e-9
+
+
+class Trigger(NamedTuple):
+    nearest_city: str
+    distance: float
+    in_city: bool
+    landmarks: Dict[str, bool]
+
+
+@dataclass
+class TriggerBatch:
+    nearest: np.ndarray  # index into TriggerTable.names
+    distance: np.ndarray  # kilometers to the nearest city
+    in_city: np.ndarray
+    landmarks: Dict[str, np.ndarray]  # landmark name -> within its radius
+
+
+class TriggerTable:
+    """Cities and landmarks to test many player positions against"""
+
+    def __init__(self, points: Dict[str, Tuple[float, float]], city_radius_km: float,
+                 landmarks: Dict[str, Tuple[Tuple[float, float], float]]):
+        self.names: List[str] = list(points)
+        self.landmark_names: List[str] = list(landmarks)
+        self.city_radius_km = city_radius_km
+        # Cities first, then landmarks, so one distance matrix covers everything
+        self.coordinates = ([tuple(points[name]) for name in self.names] +
+                            [tuple(landmarks[name][0]) for name in self.landmark_names])
+        self.radii = np.array([city_radius_km] * len(self.names) +
+                              [landmarks[name][1] for name in self.landmark_names])
+        self._index = ProximityIndex(points)
+        self._landmarks = [(name, tuple(position), radius) for name, (position, radius) in landmarks.items()]
+        self._lat = np.radians([lat for lat, _ in self.coordinates])
+        self._lon = np.radians([lon for _, lon in self.coordinates])
+
+    def evaluate(self, lat, lon, exact_nearest: bool = True) -> TriggerBatch:
+        """Check arrays of N positions (in degrees) against every city and landmark.
+
+        With exact_nearest=False, near-ties between two cities are left to
+        the sphere unless they could change the in-city flag, which keeps
+        large batches away from geodesic calls.
+        """
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        distances = haversine_km_array(np.radians(lat)[:, None], np.radians(lon)[:, None],
+                                       self._lat, self._lon)
+        cities = len(self.names)
+        to_cities = distances[:, :cities]
+        rows = np.arange(len(lat))
+        nearest = to_cities.argmin(axis=1)
+        distance = to_cities[rows, nearest]
+
+        # Near-ties between cities: any of them could be the true nearest
+        band = (distance * TIE_FACTOR + 1e-9)[:, None]
+        ties = (to_cities <= band).sum(axis=1) > 1
+        if not exact_nearest:
+            ties &= distance < self.city_radius_km * TIE_FACTOR
+        for row in np.flatnonzero(ties):
+            for column in np.flatnonzero(to_cities[row] <= band[row]):
+                to_cities[row, column] = geodesic_km((lat[row], lon[row]), self.coordinates[column])
+
+        # Distances close enough to a radius that the sphere could flip the flag
+        unsure = np.zeros(distances.shape, dtype=bool)
+        unsure[rows, nearest] = ~ties & near_boundary_array(distance, self.city_radius_km)
+        unsure[:, cities:] = near_boundary_array(distances[:, cities:], self.radii[cities:])
+        for row, column in zip(*np.nonzero(unsure)):
+            distances[row, column] = geodesic_km((lat[row], lon[row]), self.coordinates[column])
+
+        nearest = to_cities.argmin(axis=1)
+        distance = to_cities[rows, nearest]
+        return TriggerBatch(
+            nearest=nearest,
+            distance=distance,
+            in_city=distance < self.city_radius_km,
+            landmarks={name: distances[:, cities + i] < self.radii[cities + i]
+                       for i, name in enumerate(self.landmark_names)}
+        )
+
+    def check(self, lat: float, lon: float) -> Trigger:
+        """evaluate() for a single position, searching the cities' KD-tree.
+
+        Near-ties between cities are always settled with the geodesic.
+        """
+        nearest, distance = self._index.nearest(lat, lon, boundary_km=self.city_radius_km)
+        landmarks = {}
+        for name, position, radius in self._landmarks:
+            to_landmark = haversine_km(lat, lon, *position)
+            if near_boundary(to_landmark, radius):
+                to_landmark = geodesic_km((lat, lon), position)
+            landmarks[name] = to_landmark < radius
+        return Trigger(
+            nearest_city=nearest,
+            distance=distance,
+            in_city=distance < self.city_radius_km,
+            landmarks=landmarks
+        )